@@ -0,0 +1,122 @@
+# api_trace.py - a JSON line for every Weka API call snaptool makes, to see which operations load the cluster
+#
+# Every API call goes through call_api() below: the scheduler's through ClusterConnection.call_weka_api,
+# and the background thread's directly.   call_api() keeps the API metrics and, when tracing is turned on
+# (--api-trace), writes a sample of the calls to a rotating JSONL file: method, parameters, start time,
+# duration, result size (items), which retry of the call it was, reconnects so far, and the calling subsystem.
+# Reconnects are traced as records of their own.   Failed calls and retries are always traced; other
+# calls are sampled at sample_rate.
+#
+# The subsystem is per thread: threads that call the API for something other than the scheduler say so
+# with set_subsystem().
+
+import json
+import time
+import random
+import logging
+import logging.handlers
+import threading
+import metrics
+
+log = logging.getLogger(__name__)
+
+DEFAULT_SUBSYSTEM = "scheduler"
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_BACKUP_COUNT = 5
+
+_context = threading.local()
+
+
+def set_subsystem(name):
+    # the subsystem (scheduler, background, retention, ui) for API calls made by this thread
+    _context.subsystem = name
+
+
+def current_subsystem():
+    return getattr(_context, 'subsystem', DEFAULT_SUBSYSTEM)
+
+
+def _result_size(result):
+    # items in a list or dict result - serializing a large snapshots_list result just to measure it would
+    # cost more than the call
+    if isinstance(result, (list, dict)):
+        return len(result)
+    return None
+
+
+class ApiTracer(object):
+    def __init__(self):
+        self.enabled = False
+        self.filename = None
+        self.sample_rate = 1.0
+        self.traced = 0
+        self.sampled_out = 0
+        self._logger = logging.getLogger("snaptool_api_trace")
+        self._logger.propagate = False      # trace records only go to the trace file
+        self._logger.setLevel(logging.INFO)
+
+    def configure(self, filename, sample_rate=1.0, max_bytes=DEFAULT_MAX_BYTES, backup_count=DEFAULT_BACKUP_COUNT):
+        handler = logging.handlers.RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        for old_handler in list(self._logger.handlers):
+            self._logger.removeHandler(old_handler)
+            old_handler.close()
+        self._logger.addHandler(handler)
+        self.filename = filename
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.enabled = True
+        log.info(f"Tracing API calls to {filename}, sampling {self.sample_rate:.0%} of successful first tries")
+
+    def trace_call(self, method, parms, start_time, duration, result=None, error=None, retry=0, reconnects=0):
+        if not self.enabled:
+            return
+        if error is None and retry == 0 and self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            self.sampled_out += 1
+            return
+        record = {'start': round(start_time, 6), 'subsystem': current_subsystem(),
+                  'thread': threading.current_thread().name, 'method': method, 'params': parms,
+                  'duration_ms': round(duration * 1000, 3), 'retry': retry, 'reconnects': reconnects}
+        if error is None:
+            record['result_items'] = _result_size(result)
+        else:
+            record['error'] = f"{type(error).__name__}: {error}"
+        self._write(record)
+
+    def trace_reconnect(self, reason, start_time, duration, connected, message=''):
+        if not self.enabled:
+            return
+        self._write({'start': round(start_time, 6), 'subsystem': current_subsystem(),
+                     'thread': threading.current_thread().name, 'event': 'reconnect', 'reason': reason,
+                     'duration_ms': round(duration * 1000, 3), 'connected': bool(connected),
+                     'message': f"{message}"})
+
+    def _write(self, record):
+        try:
+            self._logger.info(json.dumps(record, default=str))
+            self.traced += 1
+        except Exception as exc:
+            log.error(f"Error writing API trace record: {exc}")
+
+
+api_tracer = ApiTracer()
+
+
+def call_api(cluster, method, parms, retry=0, reconnects=0):
+    # cluster.call_api(), counted and timed for the metrics and traced; retry and reconnects are for callers
+    # that retry a failed call (this is their retry'th try, after that many reconnects)
+    start_time = time.time()
+    start = time.perf_counter()
+    metrics.api_calls.inc(method)
+    result, error = None, None
+    try:
+        result = cluster.call_api(method=method, parms=parms)
+        return result
+    except Exception as exc:
+        error = exc
+        metrics.api_errors.inc(method)
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        metrics.api_latency.observe(duration, method)
+        if api_tracer.enabled:
+            api_tracer.trace_call(method, parms, start_time, duration, result, error, retry, reconnects)
@@ -16,13 +16,18 @@ import uuid
 import logging
 import string
 import datetime
-import pandas as pd
+import sqlite3
+import inventory
+import metrics
+import api_trace
 
 logdir = "logs"
 log = logging.getLogger(__name__)
 actions_log = logging.getLogger("snapshot_actions_log")
 intent_log_filename = "snap_intent_q.log"
 intent_log = 'Global uninitialized'
+INTENT_LOG_DURABILITY = ['none', 'batch', 'record']
+DEFAULT_INTENT_LOG_BATCH_WINDOW = 0.001     # seconds
 
 
 class UploadDownloadQueue(queue.Queue):
@@ -40,6 +45,302 @@ class UploadDownloadQueue(queue.Queue):
 
 background_q = UploadDownloadQueue()
 
+
+def lane_for_operation(op):
+    if op == "upload" or op == "upload-remote":
+        return "upload"
+    return "delete"
+
+class OperationLanes(object):
+    # QueueOperations taken off background_q are run by a pool of worker threads per lane, so a long
+    # upload never holds up deletes.   Operations on the same filesystem/snapshot still run in the order
+    # they were queued: while one is running, later ones for that snapshot wait here.
+    def __init__(self, upload_workers=2, delete_workers=4):
+        self._lock = threading.Lock()
+        self.lanes = {"upload": queue.Queue(), "delete": queue.Queue()}
+        self.wanted_workers = {"upload": upload_workers, "delete": delete_workers}
+        self.workers = {"upload": {}, "delete": {}}     # slot number -> worker thread
+        self._active = {}       # (fsname, snapname) -> deque of operations waiting behind the active one
+        self.running = {}       # (fsname, snapname) -> operation currently being worked on
+
+    def set_worker_counts(self, upload_workers, delete_workers):
+        # worker threads are started/stopped by background_processor to match
+        self.wanted_workers = {"upload": upload_workers, "delete": delete_workers}
+
+    def submit(self, q_op):
+        key = (q_op.fsname, q_op.snapname)
+        with self._lock:
+            if key in self._active:
+                log.debug(f"{q_op.operation} {q_op.fsname}/{q_op.snapname} waiting for earlier operation")
+                self._active[key].append(q_op)
+                return
+            self._active[key] = deque()
+        self.lanes[lane_for_operation(q_op.operation)].put(q_op)
+
+    def started(self, q_op):
+        with self._lock:
+            self.running[(q_op.fsname, q_op.snapname)] = q_op
+
+    def done(self, q_op):
+        key = (q_op.fsname, q_op.snapname)
+        with self._lock:
+            self.running.pop(key, None)
+            waiting = self._active.get(key)
+            if waiting:
+                next_op = waiting.popleft()
+            else:
+                self._active.pop(key, None)
+                return
+        self.lanes[lane_for_operation(next_op.operation)].put(next_op)
+
+    def pending_operations(self):
+        # operations not yet complete, in roughly the order they will run
+        with self._lock:
+            result = list(self.running.values())
+            for lane in self.lanes.values():
+                result += list(lane.queue)
+            for waiting in self._active.values():
+                result += list(waiting)
+        return result
+
+operation_lanes = OperationLanes()
+
+def pending_operations():
+    return list(background_q.queue) + operation_lanes.pending_operations()
+
+def queue_depth_by_operation():
+    depth = {(op,): 0 for op in ("upload", "upload-remote", "delete")}
+    for q_op in pending_operations():
+        depth[(q_op.operation,)] = depth.get((q_op.operation,), 0) + 1
+    return depth
+
+def _intent_log_metric(get):
+    # intent_log is a placeholder string until init_background_q()
+    return lambda: None if isinstance(intent_log, str) else get(intent_log)
+
+operation_seconds = metrics.histogram("snaptool_background_operation_seconds",
+                                      "Time from an upload or delete starting to it finishing, by operation",
+                                      ["operation"], buckets=metrics.OPERATION_BUCKETS)
+operation_progress = metrics.counter("snaptool_background_progress_percent_total",
+                                     "Percentage points of upload/delete progress reported by the cluster;"
+                                     " rate() gives percent per second", ["operation"])
+metrics.gauge("snaptool_background_queue_depth", "Background operations not yet complete, by operation",
+              ["operation"], callback=queue_depth_by_operation)
+metrics.gauge("snaptool_intent_log_bytes", "Size of the operation intent log on disk",
+              callback=_intent_log_metric(lambda il: il.size_bytes()))
+metrics.gauge("snaptool_intent_log_replay_seconds", "Time the intent log replay at startup took",
+              callback=_intent_log_metric(lambda il: il.replay_seconds))
+
+
+class StatusLookup(object):
+    # Snapshot status lookups for the background workers.   Each cluster call fetches every snapshot of a
+    # filesystem, so concurrent lookups for the same filesystem share one call, and repeat lookups within
+    # ttl seconds are answered from the cached result.   Callers invalidate a filesystem after changing it.
+    def __init__(self, ttl=2.0):
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self._cache = {}        # fsname -> (time.monotonic() fetched, {snapname: status})
+        self._in_flight = {}    # fsname -> threading.Event set when the fetch finishes
+        self.lookups = 0
+        self.api_calls = 0
+        self.cache_hits = 0
+        self.coalesced = 0
+
+    def calls_saved(self):
+        return self.lookups - self.api_calls
+
+    def invalidate(self, fsname):
+        with self._lock:
+            self._cache.pop(fsname, None)
+
+    def lookup(self, cluster, fsname, snapname):
+        # returns the snapshot status dict, or None if the snapshot doesn't exist
+        return self.fs_snapshots(cluster, fsname).get(snapname)
+
+    def fs_snapshots(self, cluster, fsname):
+        # returns {snapname: status} for every snapshot of fsname
+        while True:
+            with self._lock:
+                cached = self._cache.get(fsname)
+                if cached and time.monotonic() - cached[0] <= self.ttl:
+                    self.lookups += 1
+                    self.cache_hits += 1
+                    return cached[1]
+                in_flight = self._in_flight.get(fsname)
+                if in_flight is None:
+                    in_flight = self._in_flight[fsname] = threading.Event()
+                    break
+            # someone else is fetching this filesystem - wait for their result
+            in_flight.wait()
+            with self._lock:
+                cached = self._cache.get(fsname)
+                if cached:
+                    self.lookups += 1
+                    self.coalesced += 1
+                    return cached[1]
+            # their fetch failed; go around and make our own call
+        try:
+            with self._lock:
+                self.lookups += 1
+                self.api_calls += 1
+            status = api_trace.call_api(cluster, "snapshots_list", {'file_system': fsname})
+            if isinstance(status, dict):
+                status = list(status.values())
+            fs_snaps = {s['name']: s for s in status}
+            with self._lock:
+                self._cache[fsname] = (time.monotonic(), fs_snaps)
+            if self.api_calls % 50 == 0:
+                log.info(f"snapshot status lookups: {self.lookups}, api calls: {self.api_calls},"
+                         f" saved: {self.calls_saved()} (cached {self.cache_hits}, coalesced {self.coalesced})")
+            return fs_snaps
+        finally:
+            with self._lock:
+                del self._in_flight[fsname]
+            in_flight.set()
+
+status_lookup = StatusLookup()
+
+class FilesystemBuckets(object):
+    # filesystem name -> obs_buckets, from filesystems_list.   Loaded at connect time and reloaded when
+    # older than ttl seconds or after a config reload, instead of listing filesystems for every upload/delete
+    def __init__(self, ttl=900):
+        self._lock = threading.Lock()
+        self.ttl = ttl
+        self.buckets = {}
+        self.loaded_at = None       # time.monotonic() of last load
+
+    def load(self, cluster):
+        fsdicts = api_trace.call_api(cluster, "filesystems_list", {})
+        if isinstance(fsdicts, dict):
+            fsdicts = fsdicts.values()
+        buckets = {fs['name']: fs['obs_buckets'] for fs in fsdicts}
+        with self._lock:
+            self.buckets = buckets
+            self.loaded_at = time.monotonic()
+        log.info(f"filesystem obs_buckets loaded for {len(buckets)} filesystems")
+        return buckets
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def _needs_load(self, fsname):
+        if self.loaded_at is None:
+            return True
+        age = time.monotonic() - self.loaded_at
+        # a filesystem we haven't seen may have been created since the last load
+        return age > self.ttl or (fsname not in self.buckets and age > 60)
+
+    def bucket_name(self, cluster, fsname, mode):
+        if self._needs_load(fsname):
+            try:
+                self.load(cluster)
+            except Exception as exc:
+                log.error(f"error getting filesystems: {exc}")
+        with self._lock:
+            buckets = self.buckets.get(fsname, [])
+        log.info(f"target name= {fsname}, buckets={buckets}")
+        for b in buckets:
+            if b['mode'].lower() == mode.lower():
+                return b['name']
+        return ''
+
+filesystem_buckets = FilesystemBuckets()
+
+class TrackedOperation(object):
+    def __init__(self, q_op, handler, error_handler, first_check, locator='', bucketname=''):
+        self.q_op = q_op
+        self.handler = handler                  # handler(tracked, snap_status or None) -> secs to next check or None
+        self.error_handler = error_handler      # error_handler(tracked, exc) -> secs to next check or None
+        self.locator = locator
+        self.bucketname = bucketname
+        self.loopcount = 0
+        self.errors = 0
+        self.progress = 0                       # last percent complete seen, for the progress metric
+        self.next_check = time.monotonic() + first_check
+        self.finished = threading.Event()
+
+class ProgressMonitor(object):
+    # Tracks all in-flight uploads and deletes.   Each poll makes one snapshots_list call, filtered to the
+    # filesystem, for each filesystem with operations due (through status_lookup, so it's shared with the
+    # workers' own status checks), and hands each of those operations its new status.   The API load grows
+    # with the number of filesystems being worked on, not with the number of operations, and never needs
+    # the full cluster snapshot list.
+    #
+    # The monitor only does the polling: each worker still waits in wait_for() until its operation
+    # finishes, and the first check is first_check seconds in.   So upload_workers and delete_workers are the
+    # number of operations in progress on the cluster at once, and every operation holds its worker for at
+    # least first_check seconds, however quickly the cluster finishes it.
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self.tracked = []
+        self.polls = 0
+
+    def wait_for(self, q_op, handler, error_handler, first_check=5.0, locator='', bucketname=''):
+        # blocks the calling worker until the handler reports the operation finished
+        tracked = TrackedOperation(q_op, handler, error_handler, first_check, locator, bucketname)
+        with self._lock:
+            self.tracked.append(tracked)
+        self._wakeup.set()
+        tracked.finished.wait()
+
+    def run(self):
+        api_trace.set_subsystem("background")
+        main_thread = threading.main_thread()
+        while main_thread.is_alive():
+            with self._lock:
+                next_due = min((t.next_check for t in self.tracked), default=None)
+            wait_secs = 1.0 if next_due is None else next_due - time.monotonic()
+            if wait_secs > 0:
+                self._wakeup.wait(min(wait_secs, 1.0))
+                self._wakeup.clear()
+                continue
+            self.poll()
+
+    def poll(self):
+        # anything due within the next second rides along on this poll
+        now = time.monotonic()
+        with self._lock:
+            due = [t for t in self.tracked if t.next_check <= now + 1.0]
+        by_fs = {}
+        for t in due:
+            by_fs.setdefault((id(t.q_op.cluster), t.q_op.fsname), []).append(t)
+        for fs_ops in by_fs.values():
+            cluster, fsname = fs_ops[0].q_op.cluster, fs_ops[0].q_op.fsname
+            try:
+                fs_snaps = status_lookup.fs_snapshots(cluster, fsname)
+                self.polls += 1
+            except Exception as exc:
+                log.error(f"Error getting snapshot status of {fsname} for {len(fs_ops)} operations: {exc}")
+                for t in fs_ops:
+                    t.errors += 1
+                    self._reschedule(t, self._call(t.error_handler, t, exc))
+                continue
+            for t in fs_ops:
+                t.loopcount += 1
+                this_snap = fs_snaps.get(t.q_op.snapname)
+                if this_snap is not None:
+                    inventory.snapshot_inventory.apply_update(this_snap)
+                self._reschedule(t, self._call(t.handler, t, this_snap))
+
+    def _call(self, handler, tracked, arg):
+        try:
+            return handler(tracked, arg)
+        except Exception as exc:
+            log.error(f"Error processing status of {tracked.q_op.get_html()}: {exc}")
+            return None
+
+    def _reschedule(self, tracked, next_check_secs):
+        if next_check_secs is None:
+            with self._lock:
+                self.tracked.remove(tracked)
+            tracked.finished.set()
+        else:
+            tracked.next_check = time.monotonic() + next_check_secs
+
+progress_monitor = ProgressMonitor()
+
 def create_log_dir_file(filename):
     prevmask = os.umask(0)
     if not os.path.isdir(logdir):
@@ -54,32 +355,214 @@ def create_log_dir_file(filename):
     os.umask(prevmask)
     return fname
 
+class LocatorView(object):
+    # The locator tables that get_records_pd returns, kept up to date from each record as it is written
+    # instead of being recomputed from the whole log.   For every fs/snapshot, the latest completed record
+    # with a locator is kept per operation; operations that share a locator are joined in time order
+    # ('upload-remote-delete' is a remote upload whose snapshot was later deleted), and the result is
+    # filed in the table for that combination.   Callers hold the IntentLog lock.
+    TABLES = ['upload', 'upload-remote', 'upload-remote-delete']
+
+    def __init__(self):
+        self._latest = {}       # (fs, snapname) -> {op: (dt, loc, bucket)}
+        self._rows = {}         # (fs, snapname) -> [(table, key)] currently filed for it
+        self._tables = {name: {} for name in self.TABLES}   # table -> {(fs, snapname, loc, bucket): row}
+
+    def rebuild(self, records):
+        self._latest, self._rows = {}, {}
+        self._tables = {name: {} for name in self.TABLES}
+        for record in records:
+            self.add(*record)
+
+    def add(self, uid, fsname, snapname, op, status, dt, loc, bucket):
+        if status != "complete" or not loc or not bucket:
+            return
+        ops = self._latest.setdefault((fsname, snapname), {})
+        if op in ops and ops[op][0] > dt:
+            return      # an older record than the one we have
+        ops[op] = (dt, loc, bucket)
+        self._refile(fsname, snapname, ops)
+
+    def _refile(self, fsname, snapname, ops):
+        for table, key in self._rows.pop((fsname, snapname), []):
+            del self._tables[table][key]
+        joined = {}     # (loc, bucket) -> ops in time order
+        for op, (dt, loc, bucket) in sorted(ops.items(), key=lambda item: item[1][0]):
+            joined.setdefault((loc, bucket), []).append(op)
+        filed = []
+        for (loc, bucket), op_list in joined.items():
+            table = '-'.join(op_list)
+            if table in self._tables:
+                key = (fsname, snapname, loc, bucket)
+                self._tables[table][key] = {'fs': fsname, 'snapname': snapname, 'loc': loc,
+                                            'bucketname': bucket, 'op': table}
+                filed.append((table, key))
+        if filed:
+            self._rows[(fsname, snapname)] = filed
+
+    def tables(self):
+        return [list(self._tables[name].values()) for name in self.TABLES]
+
+
 class IntentLog(object):
-    def __init__(self, logfilename):
+    # Records are appended to the tail file (self.filename).   When the tail grows past compact_bytes, the
+    # current state is written to a checkpoint file and the tail is truncated - the checkpoint keeps the
+    # latest record for every operation still in progress, and the latest completed upload record (with its
+    # locator) for every fs/snapshot/operation.   Readers see the checkpoint followed by the tail.
+    #
+    # Writers share one open file handle and are group-committed: records that arrive while a batch is being
+    # written go out together in the next one.   durability is one of
+    #   none   - written to the OS when the batch is flushed, no fsync
+    #   batch  - one fsync per batch; put_record returns after its batch is on disk
+    #   record - fsync after every record
+    replay_seconds = None
+
+    def __init__(self, logfilename, compact_bytes=1024 * 1024, durability='batch',
+                 batch_window=DEFAULT_INTENT_LOG_BATCH_WINDOW):
+        if durability not in INTENT_LOG_DURABILITY:
+            raise ValueError(f"Invalid intent log durability '{durability}'")
         self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
         self.filename = create_log_dir_file(logfilename)
-
-    def rotate(self):  # only rotate if needed
-        with self._lock:
-            file_stat = os.stat(self.filename)
-            filesize = file_stat.st_size
-
-            if filesize > 1024 * 1024:
-                # move file to .1
-                if os.path.exists(self.filename + '.1'):
-                    os.remove(self.filename + '.1')
-                os.rename(self.filename, self.filename + '.1')
+        self.checkpoint_filename = self.filename + '.checkpoint'
+        self.legacy_filename = self.filename + '.1'     # from versions that rotated instead of compacting
+        self.compact_bytes = compact_bytes
+        self.compactions = 0
+        self.durability = durability
+        self.batch_window = batch_window    # seconds a batch leader waits for others to join (batch durability)
+        self.batches = 0
+        self._pending = []
+        self._appended = 0      # records handed to put_record
+        self._written = 0       # records written (and synced, per durability)
+        self._unsynced = 0      # records written by a batch that then failed; counted when a later batch syncs
+        self._writing = False
+        self._fd = None
+        self.locator_view = LocatorView()
+        if os.path.exists(self.legacy_filename) or self._tail_size() > compact_bytes:
+            self.compact()
+        self.locator_view.rebuild(self._read_records())
+        self._fd = open(self.filename, "a")
+
+    def _tail_size(self):
+        try:
+            return os.stat(self.filename).st_size
+        except FileNotFoundError:
+            return 0
+
+    def size_bytes(self):
+        # space the log takes on disk
+        return sum(os.path.getsize(f) for f in [self.checkpoint_filename, self.legacy_filename, self.filename]
+                   if os.path.exists(f))
+
+    def compact(self):
+        with self._cond:
+            self._wait_for_writer()
+            self._compact_locked()
+
+    def _wait_for_writer(self):
+        # called with the lock held; a batch may be mid-write with the lock released
+        while self._writing:
+            self._cond.wait()
+
+    def _live_records(self):
+        # the records a compacted log must keep: the latest record of every operation that has not completed,
+        # and the latest completed record with a locator for every fs/snapshot/operation
+        latest_by_uid = {}
+        latest_locators = {}
+        for record in self._read_records():
+            uid, fsname, snapname, op, status, dt, loc, bucket = record
+            latest_by_uid[uid] = record
+            if status == "complete" and loc and bucket:
+                key = (fsname, snapname, op)
+                if key not in latest_locators or latest_locators[key][5] <= dt:
+                    latest_locators[key] = record
+        keep = [r for r in latest_by_uid.values() if r[4] != "complete"]
+        keep += sorted(latest_locators.values(), key=lambda r: r[5])
+        return keep
+
+    def _compact_locked(self):
+        start = time.time()
+        keep = self._live_records()
+        tmp_filename = self.checkpoint_filename + '.tmp'
+        with open(tmp_filename, "w") as fd:
+            for record in keep:
+                fd.write(":".join(record) + "\n")
+            fd.flush()
+            os.fsync(fd.fileno())
+        os.chmod(tmp_filename, 0o666)
+        os.replace(tmp_filename, self.checkpoint_filename)
+        # everything in the tail and legacy file is now in the checkpoint
+        if self._fd is not None:
+            self._fd.close()
+        with open(self.filename, "w"):
+            pass
+        if self._fd is not None:
+            self._fd = open(self.filename, "a")
+        if os.path.exists(self.legacy_filename):
+            os.remove(self.legacy_filename)
+        self.compactions += 1
+        elapsed_ms = round((time.time() - start) * 1000, 1)
+        log.info(f"Compacted intent log: {len(keep)} records in checkpoint ({elapsed_ms} ms)")
 
     # append a record
     def put_record(self, uuid_s, fsname, snapname, snap_op, status, dt='now', loc='', bucket=''):
         if dt == 'now':
             dt = datetime.datetime.now().strftime("%Y%m%d.%H%M%S.%f")
-        with self._lock:
-            with open(self.filename, "a") as fd:
-                fd.write(f"{uuid_s}:{fsname}:{snapname}:{snap_op}:{status}:{dt}:{loc}:{bucket}\n")
+        with self._cond:
+            self._pending.append(f"{uuid_s}:{fsname}:{snapname}:{snap_op}:{status}:{dt}:{loc}:{bucket}\n")
+            self.locator_view.add(uuid_s, fsname, snapname, snap_op, status, dt, loc, bucket)
+            self._appended += 1
+            my_record = self._appended
+            while self._written < my_record:
+                if self._writing:
+                    self._cond.wait()   # someone else is writing a batch; ours may be in it, or be the next one
+                else:
+                    self._write_batch()
+
+    def _write_batch(self):
+        # called with the lock held, by the thread that becomes the leader for the next batch
+        self._writing = True
+        try:
+            if self.durability == 'batch' and self.batch_window > 0:
+                self._cond.wait(self.batch_window)      # releases the lock so others can add to the batch
+            batch, self._pending = self._pending, []
+            unsynced, self._unsynced = self._unsynced, 0
+            # do the I/O without the lock, so the records that arrive meanwhile queue up for the next batch
+            self._lock.release()
+            written = 0     # records of this batch handed to the file
+            try:
+                if self.durability == 'record':
+                    for line in batch:
+                        self._fd.write(line)
+                        written += 1
+                        self._fd.flush()
+                        os.fsync(self._fd.fileno())
+                else:
+                    for line in batch:
+                        self._fd.write(line)
+                        written += 1
+                    self._fd.flush()
+                    if self.durability == 'batch':
+                        os.fsync(self._fd.fileno())
+            except Exception:
+                self._lock.acquire()
+                # writing the records that reached the file again would duplicate them, so only the rest are
+                # retried by the next leader; the written ones count as written once its sync succeeds
+                self._unsynced = unsynced + written
+                self._pending = batch[written:] + self._pending
+                raise
+            self._lock.acquire()
+            self._written += unsynced + len(batch)
+            self.batches += 1
+            if self._tail_size() > self.compact_bytes:
+                self._compact_locked()
+        finally:
+            self._writing = False
+            self._cond.notify_all()
 
     # replay the log on a cluster
     def replay(self, cluster):
+        start = time.monotonic()
         log.info(f"Replaying background intent log")
         log.info(f"running undeleted locators processing...")
         self.cleanup_intent_log(cluster)
@@ -91,31 +574,36 @@ class IntentLog(object):
             QueueOperation(cluster, fsname, snapname, snap_op, uuid_str=uuid_str)
         replay_elapsed_ms = round((time.time() - replay_start) * 1000, 1)
         log.warning(f"Replay intent log took {replay_elapsed_ms} ms")
+        self.replay_seconds = time.monotonic() - start     # including the locator cleanup
 
-    # yield back all records - returns uuid, fsname, snapname, operation, status
+    # yield back all records - returns uuid, fsname, snapname, operation, status, dt, loc, bucket
     def _records(self):
-        with self._lock:
-            for filename in [self.filename + '.1', self.filename]:
-                try:
-                    with open(filename, "r") as fd:
-                        for record in fd:
-                            record = record.split('\n')[0] # remove newline
-                            temp = record.split(':')
-                            if len(temp) not in (5, 8):
-                                log.error(f"Invalid record in intent log: {record}")
-                                continue
-                            uid, fs, name, op, status = temp[0:5]
-                            if len(temp) == 5:
-                                dt = name.split(".",-1)[1]
-                                loc, bucket = '', ''
-                            if len(temp) == 8:
-                                dt = temp[5]
-                                loc = temp[6]
-                                bucket = temp[7]
-                            yield temp[0], temp[1], name, temp[3], temp[4], dt, loc, bucket                                 
-                except FileNotFoundError:
-                    log.info(f"Log file {filename} not found")
-                    continue
+        with self._cond:
+            self._wait_for_writer()
+            yield from self._read_records()
+
+    def _read_records(self):
+        for filename in [self.checkpoint_filename, self.legacy_filename, self.filename]:
+            try:
+                with open(filename, "r") as fd:
+                    for record in fd:
+                        record = record.split('\n')[0] # remove newline
+                        temp = record.split(':')
+                        if len(temp) not in (5, 8):
+                            log.error(f"Invalid record in intent log: {record}")
+                            continue
+                        uid, fs, name, op, status = temp[0:5]
+                        if len(temp) == 5:
+                            dt = name.split(".",-1)[1]
+                            loc, bucket = '', ''
+                        if len(temp) == 8:
+                            dt = temp[5]
+                            loc = temp[6]
+                            bucket = temp[7]
+                        yield temp[0], temp[1], name, temp[3], temp[4], dt, loc, bucket
+            except FileNotFoundError:
+                log.info(f"Log file {filename} not found")
+                continue
 
     # un-completed records - an iterable
     def _incomplete_records(self):
@@ -164,33 +652,16 @@ class IntentLog(object):
                 log.debug(f"re-queueing snapshot = {snapshot}, status={status}")
                 yield uid, snapshot['fsname'], snapshot['snapname'], snapshot['operation']
 
+    # locators of completed uploads: [local ('upload'), remote ('upload-remote'),
+    # remote-deleted ('upload-remote-delete')], each a list of {fs, snapname, loc, bucketname, op} dicts
     def get_records_pd(self):
-        names = ['uid', 'fs', 'snapname', 'op', 'status', 'dt', 'loc', 'bucketname']
         with self._lock:
-            df = pd.read_csv(self.filename, sep=':', names=names)
-        log.info(df.count())
-        complete = df.loc[df['status'] == 'complete']
-        log.info(f"complete count: {len(complete)}")
-        withloc_complete = complete.dropna()
-        log.info(f"complete notna count: {len(withloc_complete)}")
-        result = withloc_complete.sort_values(by=['fs','snapname','dt'])
-        result = result.drop_duplicates(keep='last', subset=['fs','snapname','op'])
-        groupbycols = ['fs','snapname','loc','bucketname']
-        result = result.groupby(groupbycols, as_index=False).agg({'op': '-'.join})
-        result = result[result.op != 'upload-delete']
-        result_local = result[result.op == 'upload']
-        result_remote = result[result.op == 'upload-remote']
-        result_remote_deleted = result[result.op == 'upload-remote-delete']
-        log.info(f"withloc complete sorted list count: {len(result)}")
-
-        return [result_local.to_dict('records'), 
-                result_remote.to_dict('records'), 
-                result_remote_deleted.to_dict('records')]
+            return self.locator_view.tables()
 
     def get_snapshots(self, cluster):
         if cluster:
-            try:  # doesn't retry - intended for quick updates when properly connected
-                all_snaps = cluster.call_api(method="snapshots_list", parms={})
+            try:  # served from the shared snapshot inventory
+                all_snaps = inventory.snapshot_inventory.get_snapshots()
                 return all_snaps
             except Exception as exc:
                 log.info(f"Error getting snapshots list: {exc}")
@@ -200,21 +671,127 @@ class IntentLog(object):
         # if there are any deleted local snapshots that aren't marked deleted, mark them
         if cluster:
             all_snaps = self.get_snapshots(cluster)
-            if isinstance(all_snaps, dict):
-                all_snaps = all_snaps.values()
             if all_snaps and len(all_snaps) > 0:    # only do cleanup if we're sure we have a connection
                 log.info(f"cluster all_snaps: {len(all_snaps)}")
+                existing = {(s['filesystem'], s['name']) for s in all_snaps}
                 local, remote, _ = self.get_records_pd()
                 for l in local + remote:
                     fs, snap = l['fs'], l['snapname']
-                    for s in all_snaps:
-                        if (s['name'] == l['snapname']) and (s['filesystem'] == l['fs']):
-                            break
-                    else:
+                    if (fs, snap) not in existing:
                         lloc, bn= l['loc'], l['bucketname']
                         log.info(f"Queueing {l['fs']} {l['snapname']} for delete")
                         QueueOperation(cluster, fs, snap, 'delete', loc=lloc, bucket=bn)
 
+class SqliteIntentLog(IntentLog):
+    # Same interface as IntentLog, kept in an SQLite database (<logfilename>.db) instead of a text file.
+    # On first use any existing text log is imported, and the text files are renamed to *.imported.
+    # durability maps to the SQLite synchronous setting.   Each record is its own transaction (there's no group
+    # commit), so 'batch' syncs every commit like 'record' does: in WAL mode NORMAL wouldn't sync commits at all
+    def __init__(self, logfilename, compact_records=20000, durability='batch'):
+        if durability not in INTENT_LOG_DURABILITY:
+            raise ValueError(f"Invalid intent log durability '{durability}'")
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._writing = False       # writes are done under the lock, so never set
+        self.durability = durability
+        self.text_filename = f"{logdir}/{logfilename}"
+        self.filename = create_log_dir_file(os.path.splitext(logfilename)[0] + ".db")
+        self.compact_records = compact_records
+        self.compactions = 0
+        self._db = sqlite3.connect(self.filename, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        synchronous = {'none': 'OFF', 'batch': 'FULL', 'record': 'FULL'}[durability]
+        self._db.execute(f"PRAGMA synchronous={synchronous}")
+        self._db.execute("CREATE TABLE IF NOT EXISTS intent_log (id INTEGER PRIMARY KEY AUTOINCREMENT,"
+                         " uid TEXT NOT NULL, fs TEXT NOT NULL, snapname TEXT NOT NULL, op TEXT NOT NULL,"
+                         " status TEXT NOT NULL, dt TEXT NOT NULL, loc TEXT NOT NULL DEFAULT '',"
+                         " bucket TEXT NOT NULL DEFAULT '')")
+        self._db.execute("CREATE INDEX IF NOT EXISTS intent_log_uid ON intent_log (uid)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS intent_log_fs_snap ON intent_log (fs, snapname)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS intent_log_status ON intent_log (status)")
+        self._import_text_log()
+        self._rows = self._db.execute("SELECT COUNT(*) FROM intent_log").fetchone()[0]
+        self.locator_view = LocatorView()
+        self.locator_view.rebuild(self._read_records())
+        self._rows_compacted = 0     # rows left by the last compaction; live records don't count toward the next
+
+    def size_bytes(self):
+        return sum(os.path.getsize(f) for f in [self.filename, self.filename + '-wal'] if os.path.exists(f))
+
+    def _import_text_log(self):
+        text_log = IntentLog.__new__(IntentLog)      # just for its reader; don't create or compact files
+        text_log.filename = self.text_filename
+        text_log.checkpoint_filename = self.text_filename + '.checkpoint'
+        text_log.legacy_filename = self.text_filename + '.1'
+        text_files = [f for f in [text_log.checkpoint_filename, text_log.legacy_filename, text_log.filename]
+                      if os.path.exists(f)]
+        if not text_files:
+            return
+        records = list(text_log._read_records())
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany("INSERT INTO intent_log (uid, fs, snapname, op, status, dt, loc, bucket)"
+                                 " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", records)
+            self._db.execute("COMMIT")
+        for f in text_files:
+            os.replace(f, f + '.imported')
+        log.warning(f"Imported {len(records)} records from {self.text_filename} into {self.filename}")
+
+    def put_record(self, uuid_s, fsname, snapname, snap_op, status, dt='now', loc='', bucket=''):
+        if dt == 'now':
+            dt = datetime.datetime.now().strftime("%Y%m%d.%H%M%S.%f")
+        with self._lock:
+            self._db.execute("INSERT INTO intent_log (uid, fs, snapname, op, status, dt, loc, bucket)"
+                             " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (uuid_s, fsname, snapname, snap_op, status, dt, loc, bucket))
+            self.locator_view.add(uuid_s, fsname, snapname, snap_op, status, dt, loc, bucket)
+            self._rows += 1
+            if self._rows - self._rows_compacted > self.compact_records:
+                self._compact_locked()
+
+    def _compact_locked(self):
+        start = time.time()
+        keep = self._live_records()
+        self._db.execute("BEGIN")
+        self._db.execute("DELETE FROM intent_log")
+        self._db.executemany("INSERT INTO intent_log (uid, fs, snapname, op, status, dt, loc, bucket)"
+                             " VALUES (?, ?, ?, ?, ?, ?, ?, ?)", keep)
+        self._db.execute("COMMIT")
+        self._rows = self._rows_compacted = len(keep)
+        self.compactions += 1
+        elapsed_ms = round((time.time() - start) * 1000, 1)
+        log.info(f"Compacted intent log: {len(keep)} records kept ({elapsed_ms} ms)")
+
+    def _read_records(self):
+        # fetched all at once, so a caller that writes while iterating doesn't see a moving table
+        rows = self._db.execute("SELECT uid, fs, snapname, op, status, dt, loc, bucket"
+                                " FROM intent_log ORDER BY id").fetchall()
+        yield from rows
+
+    # un-completed records, straight from the status index rather than a scan of the whole history
+    def _incomplete_records(self):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT l.uid, l.fs, l.snapname, l.op, l.status FROM intent_log l"
+                " JOIN (SELECT uid, MAX(id) AS id FROM intent_log WHERE uid IN"
+                "       (SELECT DISTINCT uid FROM intent_log WHERE status != 'complete') GROUP BY uid) latest"
+                " ON l.id = latest.id WHERE l.status != 'complete' ORDER BY l.id").fetchall()
+        log.info(f"intent-log incomplete records len: {len(rows)}")
+        for status in ["in-progress", "error", "queued"]:
+            for uid, fsname, snapname, cluster_op, rec_status in rows:
+                if rec_status == status:
+                    yield uid, fsname, snapname, cluster_op
+
+    def locators(self, fsname, snap_op='upload'):
+        # completed locators for one filesystem, e.g. locators('fs01') for all its local uploads
+        with self._lock:
+            rows = self._db.execute("SELECT snapname, loc, bucket, MAX(dt) FROM intent_log"
+                                    " WHERE fs = ? AND op = ? AND status = 'complete' AND loc != ''"
+                                    " GROUP BY snapname", (fsname, snap_op)).fetchall()
+        return [{'fs': fsname, 'snapname': snapname, 'loc': loc, 'bucketname': bucket}
+                for snapname, loc, bucket, _ in rows]
+
+
 base_62_digits = string.digits + string.ascii_uppercase + string.ascii_lowercase
 
 def int_to_base_62(num: int):
@@ -255,7 +832,7 @@ class QueueOperation(object):
 
         # queue the request
         if op == "delete":
-            for i in list(background_q.queue):
+            for i in pending_operations():
                 if i.fsname == fsname and i.snapname == snapname and i.operation == "delete":
                     log.debug(f"duplicate delete for {fsname}/{snapname} {op} ignored")
                     return           # already in the queue, don't queue again for deletes
@@ -274,34 +851,21 @@ def background_processor():
     def snapshot_status(q_snap_obj):
         fsname = q_snap_obj.fsname
         snapname = q_snap_obj.snapname
-        cluster = q_snap_obj.cluster
         # get snap info via api - assumes snap has been created already
-        status = []
-        for i in range(3):   # try 3 times on some errors
-            try:
-                status = cluster.call_api(method="snapshots_list",
-                                            parms={'file_system': fsname, 'name': snapname})
-            except Exception as exc:
-                log.error(f"Error getting snapshot status for {fsname}/{snapname}: {exc}")
-                if "(502) Bad Gateway" in str(exc):
-                    # pause and try again
-                    time.sleep(5)
-                    continue
-                else:
-                    raise  # API error - let calling routine handle it
-        
-        if len(status) == 0:
+        # API errors are raised - let calling routine handle them
+        status = status_lookup.lookup(q_snap_obj.cluster, fsname, snapname)
+        if status is None:
             # hmm... this one doesn't exist on the cluster? Let calling routine handle it
             # might be on purpose, or checking that it got deleted
             return None
-        elif len(status) > 1:
-            log.warning(f"More than one snapshot returned for {fsname}/{snapname}")
-        else:
-            log.debug(f"Snapshot status for {fsname}/{snapname}: {status}")
-        if isinstance(status, dict):
-            status = list(status.values())
+        log.debug(f"Snapshot status for {fsname}/{snapname}: {status}")
+        inventory.snapshot_inventory.apply_update(status)
+        return status
 
-        return status[0]
+    def snapshot_missing(fsname, snapname):
+        # the cluster says the snapshot doesn't exist - if the inventory thought it did, it has drifted
+        if inventory.snapshot_inventory.apply_delete(fsname, snapname):
+            inventory.snapshot_inventory.invalidate(f"{fsname}/{snapname} in inventory but not on cluster")
 
     # sleep_time will increase sleep time so we don't spam the logs
     def sleep_time(loopcount, progress):
@@ -333,31 +897,8 @@ def background_processor():
                 return 5.0    # first 25s
         return 2.0  # default
 
-    def getFileSystems(cluster):
-        try:
-            fsdict = cluster.call_api(method="filesystems_list", parms={})
-            return fsdict
-        except Exception as exc:
-            log.error(f"error getting filesystems: {exc}")
-            return {}
-    
     def getFilesystemBucketName(cluster, fsname, mode):
-        fsdicts = getFileSystems(cluster)
-        fsinfo = None
-        buckets = []
-        if isinstance(fsdicts, dict):
-            fsdicts = fsdicts.values()
-        for fs in fsdicts:
-            log.info(f"fs info {fs}, target name= {fsname}")
-            if fs['name'] == fsname:
-                fsinfo = fs
-                buckets = fsinfo['obs_buckets']
-                log.info(f"target name= {fsname}, buckets={buckets}")
-                break
-        for b in buckets:
-            if b['mode'].lower() == mode.lower():
-                return b['name']
-        return ''
+        return filesystem_buckets.bucket_name(cluster, fsname, mode)
 
     def getStatInfo(snap_stat, op):
         localstatus = snap_stat['localStowInfo']
@@ -391,6 +932,7 @@ def background_processor():
         actions_log.info(message)
 
     def delete_completed(fsname, snapname, op, uuid, locator='', bucketname='', reason="deleted"):
+        inventory.snapshot_inventory.apply_delete(fsname, snapname)
         intent_log.put_record(uuid, fsname, snapname, "delete", "complete", loc=locator, bucket=bucketname)
         message = f"{op} complete: {fsname} - {snapname} locator: '{locator}' bucket: '{bucketname}'"
         if reason != "deleted":
@@ -413,7 +955,6 @@ def background_processor():
         cluster = q_upload_obj.cluster
         bucketname = ''
         locator = ''
-        bq = background_q
 
         try:
             snap_stat = snapshot_status(q_upload_obj)
@@ -425,6 +966,7 @@ def background_processor():
 
         if snap_stat == None:
             log.error(f"{fsname}/{snapname} doesn't exist.  Not created or already deleted?  Logging as complete...")
+            snapshot_missing(fsname, snapname)
             upload_completed(fsname, snapname, op, uuid, reason="snapshot_missing")
             return
 
@@ -434,10 +976,10 @@ def background_processor():
             # Hasn't been uploaded yet; Try to upload the snap via API
             try:
                 log.info(f"{op} snapshot {fsname}/{snapname} obs_site: {obs_site}")
-                snaps = cluster.call_api(method="snapshot_upload",
-                                            parms={'file_system': fsname, 
-                                                    'snapshot': snapname,
-                                                    'obs_site': obs_site})
+                snaps = api_trace.call_api(cluster, "snapshot_upload", {'file_system': fsname,
+                                                                      'snapshot': snapname,
+                                                                      'obs_site': obs_site})
+                status_lookup.invalidate(fsname)
                 log.info(f"api result from upload call: {snaps}")
                 locator = snaps['locator']
                 bucketname = getFilesystemBucketName(cluster, fsname, obs_mode)
@@ -460,51 +1002,54 @@ def background_processor():
             return
 
         # otherwise, it should be uploading, so we fall through and monitor it
-        # monitor progress - we have to wait for this one to complete before uploading another
-        sleeptime = 5.0
-        loopcount = 0
-        shortloopcount = 0
-        while True:
-            time.sleep(sleeptime)  # give it some time to upload, check in every 5s
-            # get snap info via api
-            try:
-                shortloopcount += 1
-                this_snap = snapshot_status(q_upload_obj)
-            except Exception as exc:
-                log.error(f"error listing snapshot status: checking status: {q_upload_obj} - {exc}")
-                if shortloopcount > 10:   # Gotten errors 10 times for this upload, let it go
-                    return
-                else:
-                    continue      # otherwise continue loop, try again
-            # track how many times we're checking the status
-            loopcount += 1
-            if this_snap != None:
-                stowProgress, stowStatus, locator, _, _ = getStatInfo(this_snap, op)
-
-                if stowStatus == "UPLOADING":
-                    progress = int(stowProgress[:-1])   # progress is something like "33%"
-                    # reduce log spam - seems to hang under 50% for a while
-                    sleeptime = sleep_time(loopcount, progress)
-                    message = f"{op} of {fsname}/{snapname} in progress: {stowProgress} complete"
-                    bq.message(message)
-                    continue
-                elif stowStatus == "SYNCHRONIZED":
-                    upload_completed(fsname, snapname, op, uuid, locator=locator, bucketname=bucketname)
-                    return
-                elif stowStatus == "NONE" and stowProgress == 'N/A' and (op == "upload-remote" or op == "upload"):
-                    log.info(f"{op} of {fsname}/{snapname} not started, waiting...")
-                    time.sleep(5)
-                    continue
-                else:
-                    message = f"{op} status of {fsname}/{snapname} is {stowStatus}/{stowProgress} - unexpected"
-                    bq.message(message)
-                    log.error(message)
-                    return  # prevent infinite loop
+        # monitor progress - this worker waits for this one to complete before uploading another
+        progress_monitor.wait_for(q_upload_obj, upload_progress, upload_status_error,
+                                  first_check=5.0, locator=locator, bucketname=bucketname)
+
+    def upload_progress(tracked, this_snap):
+        # called by the progress monitor with the latest status; returns seconds until the next check,
+        # or None when the upload is finished
+        q_upload_obj = tracked.q_op
+        fsname, snapname, op = q_upload_obj.fsname, q_upload_obj.snapname, q_upload_obj.operation
+        if this_snap != None:
+            stowProgress, stowStatus, tracked.locator, _, _ = getStatInfo(this_snap, op)
+
+            if stowStatus == "UPLOADING":
+                progress = int(stowProgress[:-1])   # progress is something like "33%"
+                count_progress(tracked, progress)
+                message = f"{op} of {fsname}/{snapname} in progress: {stowProgress} complete"
+                background_q.message(message)
+                # reduce log spam - seems to hang under 50% for a while
+                return sleep_time(tracked.loopcount, progress)
+            elif stowStatus == "SYNCHRONIZED":
+                upload_completed(fsname, snapname, op, q_upload_obj.uuid,
+                                 locator=tracked.locator, bucketname=tracked.bucketname)
+                return None
+            elif stowStatus == "NONE" and stowProgress == 'N/A' and (op == "upload-remote" or op == "upload"):
+                log.info(f"{op} of {fsname}/{snapname} not started, waiting...")
+                return 5.0
             else:
-                message = f"{op}: no snap status for {fsname}/{snapname}?"
-                bq.message(message)
-                return  
- 
+                message = f"{op} status of {fsname}/{snapname} is {stowStatus}/{stowProgress} - unexpected"
+                background_q.message(message)
+                log.error(message)
+                return None  # prevent infinite loop
+        else:
+            message = f"{op}: no snap status for {fsname}/{snapname}?"
+            background_q.message(message)
+            return None
+
+    def count_progress(tracked, progress):
+        # the cluster reports percent complete rather than bytes, so progress is counted in percentage points
+        if progress > tracked.progress:
+            operation_progress.inc(tracked.q_op.operation, amount=progress - tracked.progress)
+            tracked.progress = progress
+
+    def upload_status_error(tracked, exc):
+        log.error(f"error listing snapshot status: checking status: {tracked.q_op} - {exc}")
+        if tracked.errors > 10:   # Gotten errors 10 times for this upload, let it go
+            return None
+        return 5.0    # otherwise try again
+
     def delete_snap(q_del_object):
         fsname = q_del_object.fsname
         snapname = q_del_object.snapname
@@ -529,6 +1074,7 @@ def background_processor():
 
         if status == None:
             # already gone? make sure it shows that way in the logs
+            snapshot_missing(fsname, snapname)
             delete_completed(fsname, snapname, "delete", 
                 uuid, locator=loc, bucketname=bucket, reason="not_found")
             return
@@ -548,8 +1094,8 @@ def background_processor():
                 bucketname = getFilesystemBucketName(cluster, fsname, obs_mode)
         try:
             # ask cluster to delete the snap
-            result = cluster.call_api(method="snapshot_delete",
-                                        parms={"file_system": fsname, "name": snapname})
+            result = api_trace.call_api(cluster, "snapshot_delete", {"file_system": fsname, "name": snapname})
+            status_lookup.invalidate(fsname)
             log.info(f"Delete result from {fsname}/{snapname}: {result}")
             log.info(f"Snap {fsname}/{snapname} delete initiated")
         except Exception as exc:
@@ -559,48 +1105,86 @@ def background_processor():
         delete_in_progress(fsname, snapname, "delete", uuid, locator=locator, bucketname=bucketname)
 
         # delete may take some time, particularly if uploaded to obj and it's big
-        time.sleep(1)  # give just a little time, just in case it's instant
-        loopcount = 0
-        while True:
-            # if may happen quickly, so sleep at the end of the cycle
-            try:
-                this_snap = snapshot_status(q_del_object)
-            except Exception as exc:
-                # when the snap no longer exists, we get a None back, so this == an error
-                # log.debug(f"snap delete raised exception")
-                log.error(f"Error getting snapshot status: {exc}")
-                return
+        # first check after just a little time, just in case it's instant
+        progress_monitor.wait_for(q_del_object, delete_progress, delete_status_error,
+                                  first_check=1.0, locator=locator, bucketname=bucketname)
+
+    def delete_progress(tracked, this_snap):
+        # called by the progress monitor with the latest status; returns seconds until the next check,
+        # or None when the delete is finished
+        q_del_object = tracked.q_op
+        fsname, snapname = q_del_object.fsname, q_del_object.snapname
+        # when the snap no longer exists, we get a None
+        if this_snap == None:
+            delete_completed(fsname, snapname, "delete", q_del_object.uuid,
+                             locator=tracked.locator, bucketname=tracked.bucketname)
+            return None
+        if this_snap['objectProgress'] == 'N/A' and this_snap['stowStatus'] == "NONE":   # wasn't uploaded.
+            log.debug(f"delete_snap: snap {fsname}/{snapname} wasn't uploaded (stowStatus NONE)")
+            progress = -1
+        elif '%' in this_snap['objectProgress']:
+            progress = int(this_snap['objectProgress'][:-1])  # progress is something like "33%", remove last char
+            count_progress(tracked, progress)
+        else:
+            progress = 0
+        message = f"   Delete of {fsname}/{snapname} progress: {this_snap['objectProgress']}"
+        background_q.message(message)
 
-            # when the snap no longer exists, we get a None from snap_status()
-            if this_snap == None:
-                delete_completed(fsname, snapname, "delete", uuid, locator=locator, bucketname=bucketname)
-                return
-            # track how many times we're checking the status
-            loopcount += 1
-            if this_snap['objectProgress'] == 'N/A' and this_snap['stowStatus'] == "NONE":   # wasn't uploaded.
-                log.debug(f"delete_snap: snap {fsname}/{snapname} wasn't uploaded (stowStatus NONE)")
-                progress = -1
-            elif '%' in this_snap['objectProgress']:
-                progress = int(this_snap['objectProgress'][:-1])  # progress is something like "33%", remove last char
-            else:
-                progress = 0
-            message = f"   Delete of {fsname}/{snapname} progress: {this_snap['objectProgress']}"
-            bq.message(message)
+        # reduce log spam - seems to hang under 50% for a while (only if it was uploaded)
+        return sleep_time(tracked.loopcount, progress)
 
-            # reduce log spam - seems to hang under 50% for a while (only if it was uploaded)
-            sleeptime = sleep_time(loopcount, progress)
-            time.sleep(sleeptime)  # give it some time to delete, check in based on progress/loop count
+    def delete_status_error(tracked, exc):
+        log.error(f"Error getting snapshot status: {exc}")
+        return None
+
+    def lane_worker(lane_name, slot):
+        api_trace.set_subsystem("background")
+        lane = operation_lanes.lanes[lane_name]
+        # exit when the pool shrinks below this worker's slot
+        while slot < operation_lanes.wanted_workers[lane_name]:
+            try:
+                snapq_op = lane.get(block=True, timeout=1)
+            except queue.Empty:
+                if main_thread.is_alive():
+                    continue
+                return
+            operation_lanes.started(snapq_op)
+            start = time.monotonic()
+            try:
+                if lane_name == "upload":
+                    time.sleep(3)   # slow down... make sure the snap is settled.
+                    upload_snap(snapq_op)   # handles its own errors
+                else:
+                    time.sleep(0.3)   # less time between deletes
+                    delete_snap(snapq_op)
+            except Exception as exc:
+                log.error(f"Unexpected error in {snapq_op.operation} {snapq_op.fsname}/{snapq_op.snapname}: {exc}")
+            finally:
+                operation_seconds.observe(time.monotonic() - start, snapq_op.operation)
+                operation_lanes.done(snapq_op)
+        log.info(f"{lane_name} worker {slot} exiting")
+
+    def adjust_workers():
+        for lane_name, workers in operation_lanes.workers.items():
+            for slot in range(operation_lanes.wanted_workers[lane_name]):
+                if slot not in workers or not workers[slot].is_alive():
+                    worker = threading.Thread(target=lane_worker, args=(lane_name, slot), daemon=True,
+                                              name=f"{lane_name}_worker_{slot}")
+                    worker.start()
+                    workers[slot] = worker
 
     #
     # main background_processor() logic here:
     #
 
     main_thread = threading.main_thread()
+    api_trace.set_subsystem("background")
 
     time.sleep(10)  # delay start until something happens.  ;)
     log.info("background_uploader starting...")
 
     while True:
+        adjust_workers()
         # take item off queue
         try:
             # don't block forever so we can keep an eye on the main thread
@@ -620,23 +1204,25 @@ def background_processor():
 
         if snapq_op.fsname == "WEKA_TERMINATE_THREAD" and snapq_op.snapname == "WEKA_TERMINATE_THREAD":
             log.info(f"background_processor: terminating thread")
+            operation_lanes.set_worker_counts(0, 0)     # workers exit after their current operation
             return
 
-        if snapq_op.operation == "upload" or snapq_op.operation == "upload-remote":
-            time.sleep(3)   # slow down... make sure the snap is settled.
-            upload_snap(snapq_op)   # handles its own errors
-        elif snapq_op.operation == "delete":
-            time.sleep(0.3)   # less time between deletes
-            delete_snap(snapq_op)
+        if snapq_op.operation in ("upload", "upload-remote", "delete"):
+            operation_lanes.submit(snapq_op)
         # elif snap.operation == "create":
         #     create_snap(snap)
 
 
 # module init
-def init_background_q():
+def init_background_q(intent_log_backend='text', intent_log_durability='batch',
+                      intent_log_batch_window=DEFAULT_INTENT_LOG_BATCH_WINDOW):
     global intent_log
     if intent_log == 'Global uninitialized':
-        intent_log = IntentLog(intent_log_filename)
+        if intent_log_backend == 'sqlite':
+            intent_log = SqliteIntentLog(intent_log_filename, durability=intent_log_durability)
+        else:
+            intent_log = IntentLog(intent_log_filename, durability=intent_log_durability,
+                                   batch_window=intent_log_batch_window)
         # background_q.locators = intent_log.undeleted_locators()
         background_q.locators = intent_log.get_records_pd()
         # start the upload thread
@@ -644,6 +1230,9 @@ def init_background_q():
         background_q_thread.daemon = True
         background_q_thread.start()
         log.info(f"background_thread = {background_q_thread}")
+        progress_monitor_thread = threading.Thread(target=progress_monitor.run, daemon=True,
+                                                   name="progress_monitor")
+        progress_monitor_thread.start()
         background_q.message("Upload/download queue process started...")
     return intent_log
 
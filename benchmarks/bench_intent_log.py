@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+
+# bench_intent_log.py - intent log record throughput with concurrent writers
+#
+# Each durability policy (none, batch, record) is timed with --threads threads each writing --records
+# records, along with the open/append/close per record writer that put_record used before group commit.
+# Log files are written to a temporary directory (--dir to put them somewhere else, e.g. the logs volume).
+#
+# usage: python benchmarks/bench_intent_log.py [--threads 16] [--records 500] [--batch-window MS] [--dir /path]
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import background
+
+
+class LegacyIntentLog(object):
+    # put_record as it was: lock, open in append mode, write one record, close
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self.filename = filename
+        self.batches = 0
+
+    def put_record(self, uuid_s, fsname, snapname, snap_op, status, dt='now', loc='', bucket=''):
+        with self._lock:
+            with open(self.filename, "a") as fd:
+                fd.write(f"{uuid_s}:{fsname}:{snapname}:{snap_op}:{status}:{dt}:{loc}:{bucket}\n")
+            self.batches += 1
+
+
+def run_writers(intent_log, num_threads, num_records):
+    def writer(t):
+        for i in range(num_records):
+            intent_log.put_record(f"uid{t}-{i}", f"fs{t:02d}", f"bench.{2101010000 + i}", "upload", "queued",
+                                  dt="20210101.000000.000000")
+    threads = [threading.Thread(target=writer, args=(t,)) for t in range(num_threads)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark intent log write throughput")
+    argparser.add_argument("--threads", type=int, default=16)
+    argparser.add_argument("--records", type=int, default=500, help="records written by each thread")
+    argparser.add_argument("--batch-window", dest="batch_window", type=float,
+                           default=background.DEFAULT_INTENT_LOG_BATCH_WINDOW * 1000, metavar="MS",
+                           help="how long a batch waits for more records with batch durability")
+    argparser.add_argument("--dir", default=None, help="directory for the log files (default: a temp dir)")
+    args = argparser.parse_args()
+
+    total = args.threads * args.records
+    print(f"{args.threads} threads x {args.records} records")
+    print(f"{'writer':<20} {'seconds':>9} {'records/s':>11} {'batches':>8}")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmpdir:
+        background.logdir = tmpdir
+        cases = [("legacy open/close", lambda: LegacyIntentLog(os.path.join(tmpdir, "legacy.log")))]
+        for durability in background.INTENT_LOG_DURABILITY:
+            cases.append((f"group {durability}",
+                          lambda d=durability: background.IntentLog(f"{d}.log", compact_bytes=1024 ** 3,
+                                                                    durability=d,
+                                                                    batch_window=args.batch_window / 1000)))
+        for name, make_log in cases:
+            intent_log = make_log()
+            secs = run_writers(intent_log, args.threads, args.records)
+            print(f"{name:<20} {secs:9.3f} {total / secs:11.0f} {intent_log.batches:8d}")
+
+
+if __name__ == '__main__':
+    main()
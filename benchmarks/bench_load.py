@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+
+# bench_load.py - end-to-end load test of snaptool against the mock cluster in mock_weka.py
+#
+# Starts a mock cluster in this process, writes a snaptool.yml that points at it with the normal cluster:
+# settings, and drives snaptool's own code through the real wekalib client: connect, then for each round
+# (one scheduled minute) the warm-up, the parallel creates of create_new_snapshots and the retention sweep,
+# with the background uploads and deletes running as they do in the daemon.   When the last round is done
+# it waits for the background queue to drain and reports create latencies, upload/delete times from
+# queued to complete (taken from the intent log records), and the API calls the mock served.
+#
+# Runs in a temporary directory (or --dir) so the logs and intent log don't mix with a real installation.
+#
+# usage: python benchmarks/bench_load.py [--filesystems 200] [--rounds 5] [--retain 2] [--upload yes]
+#                                        [--latency 0.05] [--error-rate 0.01] [--output bench_load.json]
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import datetime
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import snaptool
+import background
+import inventory
+import retention
+import api_trace
+import mock_weka
+
+LOAD_CONFIG = """cluster:
+   auth_token_file: {authfile}
+   hosts: 127.0.0.1
+   mgmt_port: {mgmt_port}
+   verify_cert: false
+   force_https: false
+
+snaptool:
+   port: 0
+   create_workers: {create_workers}
+   upload_workers: {upload_workers}
+   delete_workers: {delete_workers}
+
+filesystems:
+{filesystems}
+
+schedules:
+   load:
+      every: day
+      interval: 1
+      retain: {retain}
+      upload: {upload}
+"""
+
+
+class OperationTimer(object):
+    # wraps the intent log's put_record to note when each background operation was queued, started and
+    # completed.   Deletes write their "complete" record when the delete starts and again when it finishes,
+    # so the last record of a status is the one kept.
+    def __init__(self, intent_log):
+        self.ops = {}       # uuid -> {'op': operation, status: time.monotonic()}
+        self._put_record = intent_log.put_record
+        intent_log.put_record = self.put_record
+
+    def put_record(self, uuid_s, fsname, snapname, snap_op, status, *args, **kwargs):
+        self.ops.setdefault(uuid_s, {'op': snap_op})[status] = time.monotonic()
+        return self._put_record(uuid_s, fsname, snapname, snap_op, status, *args, **kwargs)
+
+    def durations(self, op_prefix, start_status, end_status):
+        return [times[end_status] - times[start_status] for times in self.ops.values()
+                if times['op'].startswith(op_prefix) and start_status in times and end_status in times]
+
+    def incomplete(self):
+        return sum(1 for times in self.ops.values() if 'complete' not in times)
+
+
+def percentiles(values):
+    if not values:
+        return {'count': 0}
+    values = sorted(values)
+    pct = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))]
+    return {'count': len(values), 'mean': round(statistics.mean(values), 3), 'p50': round(pct(50), 3),
+            'p95': round(pct(95), 3), 'p99': round(pct(99), 3), 'max': round(values[-1], 3)}
+
+
+def write_config(filename, args, authfile, port, fsnames):
+    with open(filename, "w") as f:
+        f.write(LOAD_CONFIG.format(authfile=authfile, mgmt_port=port, create_workers=args.create_workers,
+                                   upload_workers=args.upload_workers, delete_workers=args.delete_workers,
+                                   filesystems="\n".join(f"   {fs}: load" for fs in fsnames),
+                                   retain=args.retain, upload=args.upload))
+
+
+def wait_for_background(timeout):
+    # wait until nothing is queued or running.   Operations that gave up after an error (a delete whose status
+    # check failed, for example) are not retried until the next retention pass, so they count as incomplete.
+    start = time.monotonic()
+    idle_checks = 0
+    while time.monotonic() - start < timeout:
+        # an operation is briefly in neither the queue nor a lane while background_processor hands it over
+        idle_checks = idle_checks + 1 if not background.pending_operations() else 0
+        if idle_checks >= 3:
+            return time.monotonic() - start
+        time.sleep(0.2)
+    return None
+
+
+def run_load(args, workdir):
+    cluster = mock_weka.MockCluster(mock_weka.options_from_args(args), args.filesystems,
+                                    args.snapshots_per_fs, args.obs)
+    server = mock_weka.start_server(cluster)
+    port = server.server_address[1]
+    authfile = mock_weka.write_auth_file(os.path.join(workdir, "mock-auth-token.json"))
+    configfile = os.path.join(workdir, "snaptool.yml")
+    write_config(configfile, args, authfile, port, list(cluster.filesystems))
+
+    if args.api_trace:
+        api_trace.api_tracer.configure(os.path.abspath(args.api_trace), sample_rate=args.api_trace_sample)
+    background.init_background_q(args.intent_log, args.intent_log_sync, args.intent_log_batch_window / 1000)
+    timer = OperationTimer(background.intent_log)
+    snaptool_args = argparse.Namespace(configfile=configfile, access_point_format="@GMT-%Y.%m.%d-%H.%M.%S")
+    snaptool_config = snaptool.SnaptoolConfig(configfile, snaptool_args)
+    snaptool_config.flask_http_port = 0
+
+    start = time.monotonic()
+    connected, _ = snaptool_config.reload(always_reconnect=True)
+    if not connected:
+        raise RuntimeError(f"unable to connect to the mock cluster on port {port}")
+    background.filesystem_buckets.load(snaptool_config.cluster_connection.weka_cluster)
+    connect_secs = time.monotonic() - start
+    print(f"connected to mock cluster on port {port} in {connect_secs:.3f}s; "
+          f"{len(cluster.filesystems)} filesystems, {cluster.snapshot_count()} snapshots")
+
+    groups = list(snaptool_config.schedules_dict.values())
+    base_time = datetime.datetime.now().replace(second=0, microsecond=0)
+    create_latencies, rounds = [], []
+    run_start = time.monotonic()
+    for i in range(args.rounds):
+        round_start = time.monotonic()
+        snap_time = base_time + datetime.timedelta(minutes=i)
+        next_snaps_dict = snaptool.get_snaps_dict_by_fs(groups, snap_time)
+        if not args.no_warmup:
+            snaptool_config.warm_up(next_snaps_dict, snap_time)
+        warmup_secs = time.monotonic() - round_start
+        create_start = time.monotonic()
+        snaptool_config.create_new_snapshots(next_snaps_dict, snap_time)
+        create_secs = time.monotonic() - create_start
+        create_latencies += list(snaptool_config.last_create_latencies.values())
+        delete_start = time.monotonic()
+        # the sweep the main loop asks the retention thread for, run here so it can be timed
+        retention.retention_sweeper.sweep(snaptool_config.cluster_connection, snaptool_config.schedules_dict)
+        retention_secs = time.monotonic() - delete_start
+        rounds.append({'round': i, 'creates': len(next_snaps_dict), 'warmup_s': round(warmup_secs, 3),
+                       'create_s': round(create_secs, 3), 'retention_pass_s': round(retention_secs, 3)})
+        print(f"round {i}: warm-up {warmup_secs:.3f}s, {len(next_snaps_dict)} creates in {create_secs:.3f}s, "
+              f"retention pass {retention_secs:.3f}s, {len(background.pending_operations())} operations pending")
+        sleep_secs = args.round_interval - (time.monotonic() - round_start)
+        if sleep_secs > 0:
+            time.sleep(sleep_secs)
+    rounds_secs = time.monotonic() - run_start
+
+    print(f"waiting for {len(background.pending_operations())} background operations...")
+    drain_secs = wait_for_background(args.timeout)
+    if drain_secs is None:
+        print(f"background operations did not finish within {args.timeout}s")
+    total_secs = time.monotonic() - run_start
+
+    with cluster.lock:
+        api_calls = dict(sorted(cluster.calls.items()))
+        result = {
+            'filesystems': args.filesystems, 'rounds': args.rounds, 'retain': args.retain, 'upload': args.upload,
+            'mock': {'latency': args.latency, 'jitter': args.jitter, 'error_rate': args.error_rate,
+                     'exists_rate': args.exists_rate, 'snapshot_size_mb': args.snapshot_size_mb,
+                     'upload_mb_per_sec': args.upload_mb_per_sec, 'delete_seconds': args.delete_seconds},
+            'connect_s': round(connect_secs, 3),
+            'rounds_s': round(rounds_secs, 3),
+            'drain_s': round(drain_secs, 3) if drain_secs is not None else None,
+            'total_s': round(total_secs, 3),
+            'per_round': rounds,
+            'create_latency_s': percentiles(create_latencies),
+            'upload_queued_to_complete_s': percentiles(timer.durations("upload", "queued", "complete")),
+            'upload_in_progress_to_complete_s': percentiles(timer.durations("upload", "in-progress", "complete")),
+            'delete_queued_to_complete_s': percentiles(timer.durations("delete", "queued", "complete")),
+            'incomplete_operations': timer.incomplete(),
+            'api_calls': api_calls,
+            'api_calls_total': sum(api_calls.values()),
+            'errors_injected': cluster.errors_injected,
+            'exists_injected': cluster.exists_injected,
+            'snapshots_at_end': cluster.snapshot_count(),
+            'status_lookups': {'lookups': background.status_lookup.lookups,
+                               'api_calls': background.status_lookup.api_calls},
+            'progress_monitor_polls': background.progress_monitor.polls,
+            'inventory_full_refreshes': inventory.snapshot_inventory.full_refreshes,
+        }
+    server.shutdown()
+    return result
+
+
+def print_result(result):
+    print(f"\n{'':<34} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for name in ['create_latency_s', 'upload_queued_to_complete_s', 'upload_in_progress_to_complete_s',
+                 'delete_queued_to_complete_s']:
+        p = result[name]
+        if p['count']:
+            print(f"{name:<34} {p['count']:>7} {p['mean']:>9.3f} {p['p50']:>9.3f} {p['p95']:>9.3f} "
+                  f"{p['p99']:>9.3f} {p['max']:>9.3f}")
+        else:
+            print(f"{name:<34} {0:>7}")
+    print(f"\nrounds {result['rounds_s']}s, background drain {result['drain_s']}s, total {result['total_s']}s")
+    print(f"api calls: {result['api_calls_total']} {result['api_calls']}")
+    print(f"incomplete operations (gave up after an error): {result['incomplete_operations']}")
+    print(f"injected: {result['errors_injected']} http 502s, {result['exists_injected']} 'already exists'; "
+          f"{result['snapshots_at_end']} snapshots on the mock cluster at the end")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="End-to-end snaptool load test against a mock cluster")
+    argparser.add_argument("--rounds", type=int, default=3, help="scheduled minutes to create snapshots for")
+    argparser.add_argument("--round-interval", dest="round_interval", type=float, default=0.0,
+                           help="minimum seconds between the starts of rounds")
+    argparser.add_argument("--retain", type=int, default=2, help="retain for the load test schedule")
+    argparser.add_argument("--upload", choices=["no", "yes", "remote"], default="no",
+                           help="upload setting for the load test schedule")
+    argparser.add_argument("--no-warmup", dest="no_warmup", action="store_true", default=False,
+                           help="don't run the pre-tick warm-up before each round's creates")
+    argparser.add_argument("--create-workers", dest="create_workers", type=int, default=16)
+    argparser.add_argument("--upload-workers", dest="upload_workers", type=int, default=2)
+    argparser.add_argument("--delete-workers", dest="delete_workers", type=int, default=4)
+    argparser.add_argument("--intent-log", dest="intent_log", default="text", choices=["text", "sqlite"])
+    argparser.add_argument("--intent-log-sync", dest="intent_log_sync", default="batch",
+                           choices=background.INTENT_LOG_DURABILITY)
+    argparser.add_argument("--intent-log-batch-window", dest="intent_log_batch_window", type=float,
+                           default=background.DEFAULT_INTENT_LOG_BATCH_WINDOW * 1000, metavar="MS")
+    argparser.add_argument("--api-trace", dest="api_trace", default=None,
+                           help="write snaptool's API call trace (JSON lines) to this file")
+    argparser.add_argument("--api-trace-sample", dest="api_trace_sample", type=float, default=1.0,
+                           help="fraction of successful API calls to trace")
+    argparser.add_argument("--timeout", type=float, default=600,
+                           help="seconds to wait for background uploads and deletes to finish")
+    argparser.add_argument("--dir", default=None, help="working directory for logs (default: a temporary one)")
+    argparser.add_argument("--output", default=None, help="also write the results to this JSON file")
+    argparser.add_argument("-v", "--verbose", action="store_true", default=False,
+                           help="log snaptool's info messages to bench_load.log in the working directory")
+    mock_weka.add_options_args(argparser)
+    argparser.set_defaults(filesystems=50)
+    args = argparser.parse_args()
+    if args.upload != "no" and args.obs == "none":
+        argparser.error("--upload needs --obs local or remote")
+    if args.upload == "remote" and args.obs != "remote":
+        argparser.error("--upload remote needs --obs remote")
+
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.dir or tempfile.mkdtemp(prefix="snaptool-load-"))
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)      # background writes its logs and intent log under ./logs
+    logging.basicConfig(filename="bench_load.log", level=logging.INFO if args.verbose else logging.WARNING,
+                        format="%(asctime)s %(threadName)s %(name)s %(levelname)s %(message)s")
+    print(f"working directory {workdir}")
+
+    result = run_load(args, workdir)
+    print_result(result)
+    if output:
+        result['snaptool_version'] = snaptool.VERSION
+        result['date'] = datetime.datetime.now().isoformat(timespec='seconds')
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nresults written to {output}")
+
+
+if __name__ == '__main__':
+    main()
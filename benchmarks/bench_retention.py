@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+# bench_retention.py - time the retention (delete old snapshots) computation
+#
+# Compares the per filesystem/schedule get_fs_snaps() scan that delete_old_snapshots used to do
+# with the single pass get_snaps_to_delete().   The legacy scan is O(entries * filesystems * snapshots),
+# so by default it is only run for a sample of the filesystems and extrapolated to the full set.
+#
+# usage: python benchmarks/bench_retention.py [--filesystems 500] [--entries 20] [--snapshots 50000]
+
+import os
+import sys
+import time
+import argparse
+import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snaptool
+import snapshots
+
+
+def make_schedules(num_entries, filesystems, retain):
+    group = snaptool.ScheduleGroup("bench")
+    for i in range(num_entries):
+        name = f"bench_e{i:02d}"
+        entry = snapshots.DailyScheduleEntry(name, [0, 1, 2, 3, 4, 5, 6], retain,
+                                             snapshots._parse_time("0000"), False)
+        entry.groupname = group.name
+        group.entries.append(entry)
+    group.filesystems = list(filesystems)
+    return {group.name: group}
+
+
+def make_snapshots(filesystems, entry_names, num_snapshots):
+    snaps = []
+    start = datetime.datetime(2021, 1, 1)
+    i = 0
+    while len(snaps) < num_snapshots:
+        for fs in filesystems:
+            for name in entry_names:
+                t = start + datetime.timedelta(minutes=i)
+                snaps.append({'filesystem': fs, 'name': f"{name}.{t.strftime('%y%m%d%H%M')}",
+                              'creationTime': t.strftime("%Y-%m-%dT%H:%M:%SZ")})
+                if len(snaps) >= num_snapshots:
+                    return snaps
+        i += 1
+    return snaps
+
+
+def legacy_snaps_to_delete(parsed_schedules_dict, all_snaps):
+    results = []
+    for sg in parsed_schedules_dict.values():
+        for entry in sg.entries:
+            for fs in sg.filesystems:
+                snaps = snaptool.get_fs_snaps(all_snaps, fs, entry.name)
+                if len(snaps) > entry.retain:
+                    results.extend((fs, s) for s in snaps[:len(snaps) - entry.retain])
+    return results
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark the snapshot retention computation")
+    argparser.add_argument("--filesystems", type=int, default=500)
+    argparser.add_argument("--entries", type=int, default=20)
+    argparser.add_argument("--snapshots", type=int, default=50000)
+    argparser.add_argument("--retain", type=int, default=4)
+    argparser.add_argument("--legacy-sample", dest="legacy_sample", type=int, default=5,
+                           help="number of filesystems to run the legacy scan on (0 for all)")
+    args = argparser.parse_args()
+
+    filesystems = [f"fs{i:04d}" for i in range(args.filesystems)]
+    schedules = make_schedules(args.entries, filesystems, args.retain)
+    entry_names = [e.name for e in schedules["bench"].entries]
+    all_snaps = make_snapshots(filesystems, entry_names, args.snapshots)
+    print(f"{args.filesystems} filesystems x {args.entries} schedule entries x {len(all_snaps)} snapshots")
+
+    new_result, new_secs = timed(snaptool.get_snaps_to_delete, schedules, all_snaps)
+    print(f"single pass:  {new_secs:10.3f}s  ({len(new_result)} snapshots to delete)")
+
+    sample = args.legacy_sample if 0 < args.legacy_sample < args.filesystems else args.filesystems
+    sample_schedules = make_schedules(args.entries, filesystems[:sample], args.retain)
+    legacy_result, legacy_secs = timed(legacy_snaps_to_delete, sample_schedules, all_snaps)
+    legacy_total = legacy_secs * args.filesystems / sample
+    estimated = f" (extrapolated from {sample} filesystems)" if sample != args.filesystems else ""
+    print(f"legacy scan:  {legacy_total:10.3f}s{estimated}")
+    print(f"speedup:      {legacy_total / new_secs:10.1f}x")
+
+    # the two must agree on what gets deleted
+    sample_set = set(filesystems[:sample])
+    new_sample = [(fs, s['name']) for fs, s in new_result if fs in sample_set]
+    legacy_sample = [(fs, s['name']) for fs, s in legacy_result]
+    if sorted(new_sample) != sorted(legacy_sample):
+        print("MISMATCH between single pass and legacy results")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
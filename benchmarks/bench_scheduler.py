@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# bench_scheduler.py - time the schedule computations in snapshots.py and the main loop helpers
+#
+# Runs each benchmark against synthetic configs across a range of schedule entry and filesystem counts,
+# prints a table, and writes the results as JSON (--output) so runs from different versions can be compared.
+# --compare takes an earlier results file and prints each benchmark's time relative to it.
+#
+# The per-loop sort that the schedule timeline replaced (_update_snaptimes_sorted) is included as
+# "legacy_update_snaptimes_sorted", for comparison with the timeline's build and per-tick costs.
+#
+# usage: python benchmarks/bench_scheduler.py [--quick] [--output bench_scheduler.json] [--compare old.json]
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import datetime
+import platform
+from operator import attrgetter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import snaptool
+import snapshots
+
+ENTRY_COUNTS = [10, 100, 1000, 10000]
+FILESYSTEM_COUNTS = [10, 100, 1000, 5000]
+QUICK_ENTRY_COUNTS = [10, 100, 1000]
+QUICK_FILESYSTEM_COUNTS = [10, 100, 1000]
+ENTRIES_PER_GROUP = 4
+NOW = datetime.datetime(2024, 3, 6, 13, 37, 21)
+
+
+def make_specs(num_entries, rnd):
+    # (group, name, spec) with a mix of monthly, daily and interval entries, as parsed from yaml (all strings)
+    specs = []
+    for i in range(num_entries):
+        kind = i % 3
+        at = f"{rnd.randint(0, 23):02d}{rnd.choice([0, 15, 30, 45]):02d}"
+        if kind == 0:
+            spec = {'every': rnd.choice(['month', 'Jan,Apr,Jul,Oct']), 'day': str(rnd.randint(1, 31)), 'at': at}
+        elif kind == 1:
+            spec = {'every': rnd.choice(['day', 'Mon,Wed,Fri', 'Sat,Sun']), 'at': at}
+        else:
+            spec = {'every': rnd.choice(['day', 'Mon,Tue,Wed,Thu,Fri']), 'at': '0000', 'until': '2359',
+                    'interval': str(rnd.choice([1, 5, 15, 60]))}
+        spec['retain'] = str(rnd.randint(1, 20))
+        specs.append((f"g{i // ENTRIES_PER_GROUP}", f"e{i % ENTRIES_PER_GROUP}", spec))
+    return specs
+
+
+def make_groups(num_entries, num_filesystems, rnd):
+    groups = {}
+    for groupname, name, spec in make_specs(num_entries, rnd):
+        entry, _ = snapshots.parse_schedule_entry(groupname, name, spec)
+        groups.setdefault(groupname, snaptool.ScheduleGroup(groupname)).entries.append(entry)
+    group_list = list(groups.values())
+    for i in range(num_filesystems):
+        for sg in rnd.sample(group_list, min(2, len(group_list))):
+            sg.filesystems.append(f"fs{i:05d}")
+    return groups
+
+
+def make_snapshots(groups, snaps_per_entry):
+    snaps = []
+    start = datetime.datetime(2024, 1, 1)
+    for sg in groups.values():
+        for fs in sg.filesystems:
+            for entry in sg.entries:
+                for i in range(snaps_per_entry):
+                    t = start + datetime.timedelta(hours=i)
+                    snaps.append({'filesystem': fs, 'name': f"{entry.name}.{t.strftime('%y%m%d%H%M')}",
+                                  'creationTime': t.strftime("%Y-%m-%dT%H:%M:%SZ")})
+    return snaps
+
+
+def legacy_update_snaptimes_sorted(snapgrouplist, now_dt):
+    # _update_snaptimes_sorted as it was before ScheduleTimeline, without its logging
+    for sg in [sg for sg in snapgrouplist if len(sg.filesystems) == 0]:
+        snapgrouplist.remove(sg)
+    for sg in snapgrouplist:
+        for entry in sg.entries:
+            entry.calc_next_snaptime(now_dt)
+        sg.entries.sort(key=attrgetter('nextsnap_dt', 'sort_priority', 'no_upload'))
+        if len(sg.entries) > 0:
+            sg.next_snap_time = sg.entries[0].nextsnap_dt
+            sg.sort_priority = sg.entries[0].sort_priority
+            sg.no_upload = sg.entries[0].no_upload
+    snapgrouplist.sort(key=attrgetter('next_snap_time', 'sort_priority', 'no_upload'))
+
+
+class Bench(object):
+    def __init__(self, min_time):
+        self.min_time = min_time
+        self.results = []
+
+    def run(self, name, params, func):
+        # calls func() repeatedly for at least min_time seconds
+        calls, total = 0, 0.0
+        while total < self.min_time or calls < 3:
+            start = time.perf_counter()
+            func()
+            total += time.perf_counter() - start
+            calls += 1
+        result = {'benchmark': name, 'params': params, 'calls': calls,
+                  'total_s': round(total, 6), 'per_call_us': round(total / calls * 1e6, 3)}
+        self.results.append(result)
+        param_str = " ".join(f"{k}={v}" for k, v in params.items())
+        print(f"{name:<34} {param_str:<32} {result['per_call_us']:>14.1f} us")
+        return result
+
+
+def bench_parse(bench, entry_counts):
+    for n in entry_counts:
+        specs = make_specs(n, random.Random(n))
+        bench.run("parse_schedule_entry", {'entries': n},
+                  lambda: [snapshots.parse_schedule_entry(g, name, spec) for g, name, spec in specs])
+
+
+def bench_calc_next(bench):
+    cases = {
+        'monthly': {'every': 'Jan,Apr,Jul,Oct', 'day': '31', 'at': '0100'},
+        'daily': {'every': 'Mon,Wed,Fri', 'at': '0900'},
+        'interval_60min': {'every': 'Mon,Tue,Wed,Thu,Fri', 'at': '0000', 'until': '2359', 'interval': '60'},
+        'interval_1min': {'every': 'day', 'at': '0000', 'until': '2359', 'interval': '1'},
+    }
+    times = [NOW + datetime.timedelta(minutes=97 * i) for i in range(200)]
+    for kind, spec in cases.items():
+        entry, _ = snapshots.parse_schedule_entry("b", kind[:10], {**spec, 'retain': '4'})
+
+        def calc_all():
+            for t in times:
+                entry.nextsnap_dt = datetime.datetime.min   # defeat the daily/monthly cache
+                entry.calc_next_snaptime(t)
+        bench.run("calc_next_snaptime", {'type': kind}, calc_all)
+        bench.run("next_snaptime_rrule", {'type': kind}, lambda: [entry.next_snaptime_rrule(t) for t in times])
+
+
+def bench_next_snaps(bench, entry_counts):
+    for n in entry_counts:
+        groups = make_groups(n, max(10, n // 10), random.Random(n))
+        bench.run("legacy_update_snaptimes_sorted", {'entries': n},
+                  lambda: legacy_update_snaptimes_sorted(list(groups.values()), NOW))
+        bench.run("schedule_timeline_build", {'entries': n},
+                  lambda: snaptool.ScheduleTimeline(groups.values(), NOW))
+        timeline = snaptool.ScheduleTimeline(groups.values(), NOW)
+        state = {'now': NOW}
+
+        def tick():
+            snap_time, _ = timeline.next_snapgroups(state['now'])
+            timeline.advance(snap_time)
+            state['now'] = snap_time + datetime.timedelta(minutes=1)
+        bench.run("schedule_timeline_tick", {'entries': n}, tick)
+
+
+def bench_snaps_dict(bench, filesystem_counts):
+    for n in filesystem_counts:
+        groups = make_groups(100, n, random.Random(n))
+        snap_time = NOW.replace(second=0)
+        all_groups = list(groups.values())      # worst case: every group due at once
+        bench.run("get_snaps_dict_by_fs", {'filesystems': n, 'groups': len(all_groups)},
+                  lambda: snaptool.get_snaps_dict_by_fs(all_groups, snap_time))
+
+
+def bench_fs_snaps(bench, filesystem_counts):
+    for n in filesystem_counts:
+        groups = make_groups(8, n, random.Random(n))
+        all_snaps = make_snapshots(groups, snaps_per_entry=5)
+        sg = next(sg for sg in groups.values() if sg.filesystems)
+        fs, entry = sg.filesystems[0], sg.entries[0]
+        bench.run("get_fs_snaps", {'filesystems': n, 'snapshots': len(all_snaps)},
+                  lambda: snaptool.get_fs_snaps(all_snaps, fs, entry.name))
+        bench.run("get_snaps_to_delete", {'filesystems': n, 'snapshots': len(all_snaps)},
+                  lambda: snaptool.get_snaps_to_delete(groups, all_snaps))
+
+
+def compare(results, baseline_file):
+    with open(baseline_file) as f:
+        baseline = json.load(f)
+    old = {(r['benchmark'], json.dumps(r['params'], sort_keys=True)): r for r in baseline['results']}
+    print(f"\ncompared with {baseline_file} (snaptool {baseline['snaptool_version']}):")
+    for r in results:
+        key = (r['benchmark'], json.dumps(r['params'], sort_keys=True))
+        if key in old:
+            ratio = r['per_call_us'] / old[key]['per_call_us'] if old[key]['per_call_us'] else float('inf')
+            param_str = " ".join(f"{k}={v}" for k, v in r['params'].items())
+            print(f"{r['benchmark']:<34} {param_str:<32} {ratio:>8.2f}x")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark snaptool schedule computations")
+    argparser.add_argument("--quick", action="store_true", default=False,
+                           help="skip the largest sizes (10000 entries, 5000 filesystems)")
+    argparser.add_argument("--min-time", dest="min_time", type=float, default=0.2,
+                           help="minimum seconds to spend on each measurement")
+    argparser.add_argument("--output", default="bench_scheduler.json", help="JSON results file")
+    argparser.add_argument("--compare", default=None, help="earlier JSON results file to compare against")
+    args = argparser.parse_args()
+    logging.disable(logging.CRITICAL)   # the scheduler logs at debug/info on every call
+
+    entry_counts = QUICK_ENTRY_COUNTS if args.quick else ENTRY_COUNTS
+    filesystem_counts = QUICK_FILESYSTEM_COUNTS if args.quick else FILESYSTEM_COUNTS
+    bench = Bench(args.min_time)
+    print(f"{'benchmark':<34} {'params':<32} {'per call':>17}")
+    bench_parse(bench, entry_counts)
+    bench_calc_next(bench)
+    bench_next_snaps(bench, entry_counts)
+    bench_snaps_dict(bench, filesystem_counts)
+    bench_fs_snaps(bench, filesystem_counts)
+
+    output = {'snaptool_version': snaptool.VERSION,
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'date': datetime.datetime.now().isoformat(timespec='seconds'),
+              'results': bench.results}
+    with open(args.output, "w") as f:
+        json.dump(output, f, indent=2)
+    print(f"\nresults written to {args.output}")
+    if args.compare:
+        compare(bench.results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+
+# bench_startup.py - snaptool startup time and memory
+#
+# Times "snaptool.py --version" (imports only) and a full start, measured until the status UI answers
+# http requests, and reports the peak RSS of each.   The full start uses a generated config that points at
+# a cluster that isn't there, in a temporary directory so the logs don't mix with a real installation.
+# --preload imports extra modules first (e.g. --preload pandas to see what importing pandas used to cost).
+# "snaptool.py --forecast" is timed too; it runs the whole forecast and exits, so it also checks that
+# forecasting works.
+#
+# usage: python benchmarks/bench_startup.py [--runs 5] [--port 18090] [--preload pandas]
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import statistics
+import urllib.request
+
+SNAPTOOL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "snaptool.py")
+
+# the config's snaptool.port replaces -p when the config is loaded, so both are set to the port being polled
+BENCH_CONFIG = """cluster:
+   auth_token_file: auth-token.json
+   hosts: 127.0.0.1
+   mgmt_port: {mgmt_port}
+   verify_cert: false
+   force_https: false
+
+snaptool:
+   port: {http_port}
+
+schedules:
+   default:
+      daily:
+         every: day
+         at: 9pm
+         retain: 4
+"""
+
+FORECAST_FILESYSTEMS = """
+filesystems:
+   fs1: default
+   fs2: default
+"""
+
+
+def snaptool_cmd(preload, args):
+    if not preload:
+        return [sys.executable, SNAPTOOL] + args
+    code = (f"import sys, runpy\n"
+            f"sys.path.insert(0, {os.path.dirname(SNAPTOOL)!r})\n"
+            f"import {', '.join(preload)}\n"
+            f"sys.argv = {[SNAPTOOL] + args!r}\n"
+            f"runpy.run_path({SNAPTOOL!r}, run_name='__main__')\n")
+    return [sys.executable, "-c", code]
+
+
+def peak_rss_mb(pid):
+    # VmHWM is the peak resident set size of a running process (linux)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float('nan')
+
+
+def time_version(preload):
+    start = time.perf_counter()
+    proc = subprocess.Popen(snaptool_cmd(preload, ["--version"]), stdout=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status)
+    elapsed = time.perf_counter() - start
+    if proc.returncode != 0:
+        raise RuntimeError(f"snaptool --version exited with {proc.returncode}")
+    return elapsed, rusage.ru_maxrss / 1024     # ru_maxrss is in KB on linux
+
+
+def time_forecast(preload, days=7):
+    with tempfile.TemporaryDirectory() as workdir:
+        configfile = os.path.join(workdir, "snaptool.yml")
+        with open(configfile, "w") as f:
+            f.write(BENCH_CONFIG.format(mgmt_port=unused_port(), http_port=0) + FORECAST_FILESYSTEMS)
+        # output goes to files rather than pipes, so a large forecast can't fill a pipe while we wait
+        with open(os.path.join(workdir, "forecast.out"), "w+") as out, \
+                open(os.path.join(workdir, "forecast.err"), "w+") as err:
+            start = time.perf_counter()
+            proc = subprocess.Popen(snaptool_cmd(preload, ["-c", configfile, "--forecast", str(days)]),
+                                    cwd=workdir, stdout=out, stderr=err)
+            _, status, rusage = os.wait4(proc.pid, 0)
+            elapsed = time.perf_counter() - start
+            out.seek(0)
+            err.seek(0)
+            output, errors = out.read(), err.read()
+        returncode = os.waitstatus_to_exitcode(status)
+        if returncode != 0:
+            raise RuntimeError(f"snaptool --forecast exited with {returncode}: {errors[-2000:]}")
+        summary = json.loads(output)
+        if not summary.get('filesystems'):
+            raise RuntimeError(f"snaptool --forecast printed no filesystems: {output[:2000]}")
+    return elapsed, rusage.ru_maxrss / 1024
+
+
+def unused_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_full_start(preload, port, timeout=60):
+    with tempfile.TemporaryDirectory() as workdir:
+        configfile = os.path.join(workdir, "snaptool.yml")
+        with open(configfile, "w") as f:
+            f.write(BENCH_CONFIG.format(mgmt_port=unused_port(), http_port=port))
+        start = time.perf_counter()
+        proc = subprocess.Popen(snaptool_cmd(preload, ["-c", configfile, "-p", str(port)]), cwd=workdir,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            while time.perf_counter() - start < timeout:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"snaptool exited with {proc.returncode} during startup")
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=1)
+                    break
+                except urllib.error.HTTPError:
+                    break       # the UI answered; an error page is fine since there is no cluster
+                except OSError:
+                    time.sleep(0.02)
+            else:
+                raise RuntimeError(f"status UI did not answer within {timeout}s")
+            elapsed = time.perf_counter() - start
+            rss = peak_rss_mb(proc.pid)
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.wait()
+    return elapsed, rss
+
+
+def report(name, results):
+    times = [t for t, _ in results]
+    rss = [r for _, r in results]
+    print(f"{name:<14} {statistics.median(times):8.3f}s {min(times):8.3f}s {max(rss):9.1f} MB")
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Benchmark snaptool startup time and memory")
+    argparser.add_argument("--runs", type=int, default=5)
+    argparser.add_argument("--port", type=int, default=18090, help="status UI port for the full start")
+    argparser.add_argument("--preload", action="append", default=[],
+                           help="import this module before snaptool (may be repeated)")
+    argparser.add_argument("--version-only", dest="version_only", action="store_true", default=False)
+    args = argparser.parse_args()
+
+    extra = f" (preloading {', '.join(args.preload)})" if args.preload else ""
+    print(f"{args.runs} runs{extra}")
+    print(f"{'':<14} {'median':>9} {'min':>9} {'peak RSS':>12}")
+    report("--version", [time_version(args.preload) for _ in range(args.runs)])
+    report("--forecast 7", [time_forecast(args.preload) for _ in range(args.runs)])
+    if not args.version_only:
+        report("full start", [time_full_start(args.preload, args.port) for _ in range(args.runs)])
+
+
+if __name__ == '__main__':
+    main()
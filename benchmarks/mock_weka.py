@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+
+# mock_weka.py - a stand-in Weka cluster API for load testing snaptool without a cluster
+#
+# Serves the JSON-RPC calls snaptool (through wekalib) makes: the login calls, status, hosts_list,
+# filesystems_list, snapshots_list, snapshot_create, snapshot_upload and snapshot_delete.   Snapshots are kept
+# in memory.   Uploads progress through stowStatus UPLOADING / stowProgress "n%" to SYNCHRONIZED over a time
+# set by the snapshot size and upload bandwidth, and deletes of uploaded snapshots stay listed with an
+# objectProgress "n%" until their delete time has passed, as on a real cluster.
+#
+# Every call can be given a latency (plus random jitter), and errors can be injected: a fraction of calls
+# answered with http 502, and a fraction of snapshot_create calls that create the snapshot but report
+# "already exists" (as when a create is retried after its reply was lost).
+#
+# Point snaptool at it with the normal cluster: section, using the auth file this writes:
+#
+#   cluster:
+#      auth_token_file: /path/to/mock-auth-token.json
+#      hosts: 127.0.0.1
+#      mgmt_port: 14000
+#      force_https: false
+#      verify_cert: false
+#
+# usage: python benchmarks/mock_weka.py [--port 14000] [--filesystems 100] [--latency 0.05] [--error-rate 0.01]
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import datetime
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+MOCK_RELEASE = "4.2.0"
+OBS_MODES = {'none': [], 'local': ['WRITABLE'], 'remote': ['WRITABLE', 'REMOTE']}
+MOCK_METHODS = ['status', 'hosts_list', 'filesystems_list', 'snapshots_list',
+                'snapshot_create', 'snapshot_upload', 'snapshot_delete']
+
+
+class MockOptions(object):
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, exists_rate=0.0, snapshot_size_mb=1024,
+                 upload_mb_per_sec=1024, delete_seconds=2.0, list_latency_per_1k=0.0, seed=None):
+        self.latency = latency                      # seconds added to every call
+        self.jitter = jitter                        # up to this many more seconds, at random
+        self.error_rate = error_rate                # fraction of calls answered with http 502
+        self.exists_rate = exists_rate              # fraction of creates that succeed but report "already exists"
+        self.snapshot_size_mb = snapshot_size_mb    # data to upload per snapshot
+        self.upload_mb_per_sec = upload_mb_per_sec  # per upload
+        self.delete_seconds = delete_seconds        # time to delete an uploaded snapshot from the bucket
+        self.list_latency_per_1k = list_latency_per_1k  # extra seconds per 1000 snapshots returned by a list
+        self.random = random.Random(seed)
+
+
+class MockSnapshot(object):
+    def __init__(self, fsname, name, access_point, creation_time):
+        self.fsname = fsname
+        self.name = name
+        self.access_point = access_point
+        self.creation_time = creation_time
+        self.uid = f"SnapshotId<{uuid.uuid4().int % 1000000}>"
+        self.stow = {'LOCAL': None, 'REMOTE': None}     # obs_site -> (locator, start, duration)
+        self.delete_started = None
+        self.delete_duration = 0.0
+
+    def _stow_info(self, site, now):
+        if self.stow[site] is None:
+            return {'locator': '', 'stowStatus': 'NONE', 'stowProgress': 'N/A'}
+        locator, start, duration = self.stow[site]
+        done = 1.0 if duration <= 0 else (now - start) / duration
+        if done >= 1.0:
+            return {'locator': locator, 'stowStatus': 'SYNCHRONIZED', 'stowProgress': '100%'}
+        return {'locator': locator, 'stowStatus': 'UPLOADING', 'stowProgress': f"{int(done * 100)}%"}
+
+    def deleted(self, now):
+        return self.delete_started is not None and now - self.delete_started >= self.delete_duration
+
+    def as_dict(self, now):
+        local = self._stow_info('LOCAL', now)
+        remote = self._stow_info('REMOTE', now)
+        if self.delete_started is not None and self.delete_duration > 0:
+            object_progress = f"{int((now - self.delete_started) / self.delete_duration * 100)}%"
+        elif local['locator'] or remote['locator']:
+            object_progress = local['stowProgress'] if local['locator'] else remote['stowProgress']
+        else:
+            object_progress = 'N/A'
+        return {'id': self.uid, 'filesystem': self.fsname, 'name': self.name, 'accessPoint': self.access_point,
+                'creationTime': self.creation_time, 'isWritable': False,
+                'stowStatus': local['stowStatus'], 'objectProgress': object_progress,
+                'localStowInfo': local, 'remoteStowInfo': remote}
+
+
+class MockCluster(object):
+    # cluster state; all methods are called with the lock held
+    def __init__(self, options, num_filesystems=10, snapshots_per_fs=0, obs_mode='local', name="mockcluster"):
+        self.options = options
+        self.name = name
+        self.guid = str(uuid.uuid4())
+        self.lock = threading.Lock()
+        self.filesystems = {}       # fsname -> obs_buckets
+        self.snapshots = {}         # fsname -> {snapname: MockSnapshot}
+        self.calls = {}             # method -> count
+        self.errors_injected = 0
+        self.exists_injected = 0
+        self.port = None
+        self._last_creation = datetime.datetime.min
+        for i in range(num_filesystems):
+            self.add_filesystem(f"fs{i:05d}", obs_mode)
+        start = datetime.datetime.utcnow() - datetime.timedelta(days=30)
+        for fsname in self.filesystems:
+            for j in range(snapshots_per_fs):
+                t = start + datetime.timedelta(minutes=j)
+                self._add_snapshot(fsname, f"preexisting.{t.strftime('%y%m%d%H%M')}", "", t)
+
+    def add_filesystem(self, fsname, obs_mode='local'):
+        self.filesystems[fsname] = [{'mode': mode, 'name': f"{fsname}-{mode.lower()}-bucket", 'state': 'ACTIVE'}
+                                    for mode in OBS_MODES[obs_mode]]
+        self.snapshots[fsname] = {}
+
+    def _add_snapshot(self, fsname, name, access_point, creation_dt):
+        snap = MockSnapshot(fsname, name, access_point, creation_dt.strftime("%Y-%m-%dT%H:%M:%SZ"))
+        self.snapshots[fsname][name] = snap
+        return snap
+
+    def _expire_deleted(self, now):
+        for fs_snaps in self.snapshots.values():
+            for name in [name for name, snap in fs_snaps.items() if snap.deleted(now)]:
+                del fs_snaps[name]
+
+    def snapshot_count(self):
+        return sum(len(s) for s in self.snapshots.values())
+
+    def _find(self, parms, name_key):
+        fsname, name = parms.get('file_system'), parms.get(name_key)
+        if fsname not in self.filesystems:
+            raise RPCError(f"Filesystem '{fsname}' does not exist")
+        snap = self.snapshots[fsname].get(name)
+        if snap is None or snap.delete_started is not None:
+            raise RPCError(f"Snapshot '{name}' does not exist in filesystem '{fsname}'")
+        return snap
+
+    def status(self, parms, now):
+        return {'name': self.name, 'guid': self.guid, 'release': MOCK_RELEASE, 'io_status': 'STARTED',
+                'status': 'OK', 'hosts': {'backends': {'active': 1, 'total': 1}}}
+
+    def hosts_list(self, parms, now):
+        return {'HostId<0>': {'hostname': '127.0.0.1', 'state': 'ACTIVE', 'status': 'UP',
+                              'mgmt_port': self.port, 'mode': 'backend'}}
+
+    def filesystems_list(self, parms, now):
+        return [{'name': fsname, 'uid': f"FSId<{i}>", 'obs_buckets': buckets}
+                for i, (fsname, buckets) in enumerate(self.filesystems.items())]
+
+    def snapshots_list(self, parms, now):
+        self._expire_deleted(now)
+        fsname, name = parms.get('file_system'), parms.get('name')
+        if fsname is not None:
+            fs_snaps = self.snapshots.get(fsname, {})
+            if name is not None:
+                snaps = [fs_snaps[name]] if name in fs_snaps else []
+            else:
+                snaps = list(fs_snaps.values())
+        else:
+            snaps = [s for fs_snaps in self.snapshots.values() for s in fs_snaps.values()]
+        return [s.as_dict(now) for s in snaps]
+
+    def snapshot_create(self, parms, now):
+        fsname, name = parms.get('file_system'), parms.get('name')
+        if fsname not in self.filesystems:
+            raise RPCError(f"Filesystem '{fsname}' does not exist")
+        if name in self.snapshots[fsname]:
+            raise RPCError(f"Snapshot name already exists: '{name}'")
+        # creationTime has one second resolution; keep it increasing so retention order is well defined
+        # when a load test creates several rounds of snapshots within a second
+        creation = max(datetime.datetime.utcnow(), self._last_creation + datetime.timedelta(seconds=1))
+        self._last_creation = creation
+        snap = self._add_snapshot(fsname, name, parms.get('access_point', ''), creation)
+        if self.options.exists_rate and self.options.random.random() < self.options.exists_rate:
+            self.exists_injected += 1
+            raise RPCError(f"Snapshot name already exists: '{name}'")
+        return snap.as_dict(now)
+
+    def snapshot_upload(self, parms, now):
+        snap = self._find(parms, 'snapshot')
+        site = parms.get('obs_site', 'LOCAL')
+        mode = 'WRITABLE' if site == 'LOCAL' else 'REMOTE'
+        if not any(b['mode'] == mode for b in self.filesystems[snap.fsname]):
+            raise RPCError(f"Filesystem '{snap.fsname}' is not tiered: cannot upload from it")
+        if snap.stow[site] is None:
+            duration = self.options.snapshot_size_mb / self.options.upload_mb_per_sec
+            snap.stow[site] = (f"{uuid.uuid4().hex[:8]}/{snap.fsname}/{snap.name}/locator", now, duration)
+        return {'locator': snap.stow[site][0]}
+
+    def snapshot_delete(self, parms, now):
+        snap = self._find(parms, 'name')
+        snap.delete_started = now
+        uploaded = any(stow is not None for stow in snap.stow.values())
+        snap.delete_duration = self.options.delete_seconds if uploaded else 0.0
+        return {}
+
+
+class RPCError(Exception):
+    pass
+
+
+class MockWekaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, cluster):
+        self.cluster = cluster
+        super().__init__(address, MockWekaHandler)
+        cluster.port = self.server_address[1]
+
+
+class MockWekaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive, as urllib3 pools the connections
+    login_methods = ('user_refresh_token', 'login', 'userlogin')
+
+    def log_message(self, format, *args):
+        log.debug(format % args)
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        cluster = self.server.cluster
+        options = cluster.options
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        method, parms, msg_id = request.get('method'), request.get('params') or {}, request.get('id')
+
+        if method in self.login_methods:
+            self._reply(200, {'jsonrpc': '2.0', 'id': msg_id,
+                              'result': {'access_token': 'mock-access-token', 'refresh_token': 'mock-refresh-token',
+                                         'token_type': 'Bearer', 'expires_in': 300}})
+            return
+
+        delay = options.latency + (options.random.random() * options.jitter if options.jitter else 0.0)
+        with cluster.lock:
+            cluster.calls[method] = cluster.calls.get(method, 0) + 1
+            inject_error = options.error_rate and options.random.random() < options.error_rate
+            if inject_error:
+                cluster.errors_injected += 1
+        if delay > 0:
+            time.sleep(delay)
+        if inject_error:
+            self._reply(502, {'error': 'Bad Gateway'})
+            return
+
+        handler = getattr(cluster, method, None) if method in MOCK_METHODS else None
+        if handler is None:
+            self._reply(200, {'jsonrpc': '2.0', 'id': msg_id,
+                              'error': {'code': -32601, 'message': f"Method not found: {method}"}})
+            return
+        try:
+            with cluster.lock:
+                result = handler(parms, time.monotonic())
+        except RPCError as exc:
+            self._reply(200, {'jsonrpc': '2.0', 'id': msg_id, 'error': {'code': -32602, 'message': str(exc)}})
+            return
+        if method == 'snapshots_list' and options.list_latency_per_1k:
+            time.sleep(len(result) / 1000 * options.list_latency_per_1k)
+        self._reply(200, {'jsonrpc': '2.0', 'id': msg_id, 'result': result})
+
+
+def write_auth_file(filename):
+    # wekalib needs an auth file; the mock accepts any token
+    with open(filename, "w") as f:
+        json.dump({'access_token': 'mock-access-token', 'refresh_token': 'mock-refresh-token',
+                   'token_type': 'Bearer'}, f)
+    return os.path.abspath(filename)
+
+
+def start_server(cluster, port=0, host="127.0.0.1"):
+    # starts the server in a daemon thread; port 0 picks a free port (server.server_address[1])
+    server = MockWekaServer((host, port), cluster)
+    thread = threading.Thread(target=server.serve_forever, name="mock_weka", daemon=True)
+    thread.start()
+    return server
+
+
+def add_options_args(argparser):
+    argparser.add_argument("--latency", type=float, default=0.0, help="seconds added to each API call")
+    argparser.add_argument("--jitter", type=float, default=0.0, help="up to this many more seconds, at random")
+    argparser.add_argument("--error-rate", dest="error_rate", type=float, default=0.0,
+                           help="fraction of API calls answered with http 502")
+    argparser.add_argument("--exists-rate", dest="exists_rate", type=float, default=0.0,
+                           help="fraction of snapshot_create calls that report 'already exists'")
+    argparser.add_argument("--snapshot-size-mb", dest="snapshot_size_mb", type=float, default=1024,
+                           help="data uploaded per snapshot")
+    argparser.add_argument("--upload-mb-per-sec", dest="upload_mb_per_sec", type=float, default=1024,
+                           help="upload bandwidth per snapshot upload")
+    argparser.add_argument("--delete-seconds", dest="delete_seconds", type=float, default=2.0,
+                           help="time to delete an uploaded snapshot")
+    argparser.add_argument("--list-latency-per-1k", dest="list_latency_per_1k", type=float, default=0.0,
+                           help="extra seconds per 1000 snapshots returned by snapshots_list")
+    argparser.add_argument("--filesystems", type=int, default=10, help="number of filesystems")
+    argparser.add_argument("--snapshots-per-fs", dest="snapshots_per_fs", type=int, default=0,
+                           help="snapshots each filesystem starts with (not snaptool's, so never deleted)")
+    argparser.add_argument("--obs", choices=list(OBS_MODES), default='local',
+                           help="object store buckets attached to each filesystem")
+    argparser.add_argument("--seed", type=int, default=None, help="random seed for jitter and error injection")
+
+
+def options_from_args(args):
+    return MockOptions(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                       exists_rate=args.exists_rate, snapshot_size_mb=args.snapshot_size_mb,
+                       upload_mb_per_sec=args.upload_mb_per_sec, delete_seconds=args.delete_seconds,
+                       list_latency_per_1k=args.list_latency_per_1k, seed=args.seed)
+
+
+def main():
+    argparser = argparse.ArgumentParser(description="Stand-in Weka cluster API for snaptool load testing")
+    argparser.add_argument("--port", type=int, default=14000, help="port to listen on")
+    argparser.add_argument("--auth-file", dest="auth_file", default="mock-auth-token.json",
+                           help="auth token file to write, for the cluster: auth_token_file setting")
+    add_options_args(argparser)
+    args = argparser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    cluster = MockCluster(options_from_args(args), args.filesystems, args.snapshots_per_fs, args.obs)
+    authfile = write_auth_file(args.auth_file)
+    server = start_server(cluster, args.port)
+    log.info(f"mock cluster '{cluster.name}' listening on port {server.server_address[1]} with "
+             f"{len(cluster.filesystems)} filesystems, {cluster.snapshot_count()} snapshots; auth file {authfile}")
+    try:
+        while True:
+            time.sleep(60)
+            with cluster.lock:
+                log.info(f"snapshots: {cluster.snapshot_count()}, calls: {cluster.calls}, "
+                         f"502s injected: {cluster.errors_injected}, 'already exists' injected: {cluster.exists_injected}")
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+# config_watch.py - notice changes to the config file as soon as they're saved
+#
+# On linux the config file's directory is watched with inotify (called through ctypes, so there's nothing
+# extra to install).   The directory is watched rather than the file because editors, and many tools that
+# write yaml, save by writing a new file and renaming it over the old one.   Where inotify isn't available
+# (not linux, no inotify instances left, or the directory goes away) the file's mtime is polled instead.
+# Either way a change sets an Event that the main loop waits on.
+
+import os
+import sys
+import time
+import errno
+import select
+import ctypes
+import ctypes.util
+import struct
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 15      # seconds between mtime checks when polling
+
+# from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct("iIII")    # wd, mask, cookie, len - followed by len bytes of name
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch     # older libcs may not have these
+        return libc
+    except (OSError, AttributeError) as exc:
+        log.info(f"inotify not available: {exc}")
+        return None
+
+
+class ConfigWatcher(object):
+    def __init__(self, poll_interval=DEFAULT_POLL_INTERVAL):
+        self.changed = threading.Event()
+        self.poll_interval = poll_interval
+        self.filename = None
+        self.mode = None            # 'inotify' or 'poll' once started
+        self.events = 0             # changes seen
+        self._lock = threading.Lock()
+        self._generation = 0        # bumped on each start(), so a watcher thread for an old file exits
+        self._wake_w = None         # written to wake the inotify thread so it can exit
+
+    def start(self, filename):
+        # watch filename (again, if it changed); safe to call repeatedly
+        filename = os.path.abspath(filename)
+        with self._lock:
+            if filename == self.filename and self.mode is not None:
+                return
+            self._stop_locked()
+            self.filename = filename
+            self._generation += 1
+            fd, watched = self._inotify_watch(filename)
+            if fd is not None:
+                wake_r, self._wake_w = os.pipe()
+                self.mode = "inotify"
+                target, args = self._watch_inotify, (self._generation, fd, wake_r)
+            else:
+                self.mode = "poll"
+                target, args = self._watch_poll, (self._generation,)
+            thread = threading.Thread(target=target, args=args, daemon=True, name="config_watch")
+            thread.start()
+        if fd is not None:
+            log.info(f"Watching {filename} for changes with inotify ({', '.join(watched)})")
+        else:
+            log.info(f"Watching {filename} for changes by polling every {self.poll_interval}s")
+
+    def wait(self, timeout):
+        # True if the config file may have changed within timeout seconds; call clear() before acting on it
+        return self.changed.wait(max(timeout, 0))
+
+    def clear(self):
+        self.changed.clear()
+
+    def notify(self):
+        # something else (the UI, after saving the file) knows the config changed
+        self.events += 1
+        self.changed.set()
+
+    def _stop_locked(self):
+        if self._wake_w is not None:
+            os.write(self._wake_w, b'x')    # the inotify thread closes its descriptors as it exits
+            os.close(self._wake_w)
+            self._wake_w = None
+        self.mode = None
+
+    def _inotify_watch(self, filename):
+        # returns (inotify fd, [watched directories]), or (None, None) to fall back to polling
+        libc = _load_libc()
+        if libc is None:
+            return None, None
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            log.warning(f"inotify_init1 failed: {os.strerror(ctypes.get_errno())}")
+            return None, None
+        # a symlinked config (a configmap volume, for example) is changed by replacing what the link points to
+        dirs = {os.path.dirname(filename), os.path.dirname(os.path.realpath(filename))}
+        for d in dirs:
+            if libc.inotify_add_watch(fd, os.fsencode(d), WATCH_MASK) < 0:
+                log.warning(f"inotify_add_watch on {d} failed: {os.strerror(ctypes.get_errno())}")
+                os.close(fd)
+                return None, None
+        return fd, sorted(dirs)
+
+    def _watching_name(self, name):
+        if os.path.islink(self.filename):
+            return True     # the link and its target can change under other names; any event is worth a look
+        return name == os.path.basename(self.filename)
+
+    def _watch_inotify(self, generation, fd, wake_r):
+        try:
+            self._read_inotify(generation, fd, wake_r)
+        finally:
+            os.close(fd)
+            os.close(wake_r)
+
+    def _read_inotify(self, generation, fd, wake_r):
+        while generation == self._generation:
+            try:
+                readable, _, _ = select.select([fd, wake_r], [], [])
+                if wake_r in readable:
+                    return      # stopped
+                data = os.read(fd, 64 * 1024)
+            except OSError as exc:
+                if exc.errno == errno.EINTR:
+                    continue
+                log.error(f"Error reading inotify events for {self.filename}: {exc}")
+                self._fall_back(generation)
+                return
+            offset, changed, lost_watch = 0, False, False
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += EVENT_HEADER.size + length
+                if mask & (IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF):
+                    lost_watch = True   # the directory itself went away
+                elif mask & IN_Q_OVERFLOW or self._watching_name(os.fsdecode(name)):
+                    changed = True
+            if changed or lost_watch:
+                log.debug(f"inotify: {self.filename} changed")
+                self.notify()
+            if lost_watch:
+                log.warning(f"Lost the inotify watch on the directory of {self.filename}")
+                self._fall_back(generation)
+                return
+
+    def _fall_back(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._stop_locked()
+            self._generation += 1
+            self.mode = "poll"
+            thread = threading.Thread(target=self._watch_poll, args=(self._generation,), daemon=True,
+                                      name="config_watch")
+            thread.start()
+        log.info(f"Watching {self.filename} for changes by polling every {self.poll_interval}s")
+
+    def _file_state(self):
+        try:
+            st = os.stat(self.filename)
+            return st.st_mtime_ns, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    def _watch_poll(self, generation):
+        last = self._file_state()
+        while generation == self._generation:
+            time.sleep(self.poll_interval)
+            state = self._file_state()
+            if state != last:
+                last = state
+                self.notify()
+
+
+config_watcher = ConfigWatcher()
@@ -1,13 +1,16 @@
-from flask import Flask, render_template
+from flask import Flask, render_template, Response
 from flask import request, jsonify
 from flask.logging import default_handler
+from werkzeug.serving import make_server
 import threading
 import time
 import logging
 import background
+import config_watch
+import metrics
+import api_trace
 import traceback
 import os
-import requests
 #import yamale
 import yaml
 from datetime import datetime
@@ -23,6 +26,12 @@ wlog.propagate = False
 wlog.setLevel(logging.WARN)
 
 sconfig = None
+ui_server = None      # werkzeug server, while the UI is running
+
+@app.before_request
+def set_api_trace_subsystem():
+    # API calls made while serving a page (a snapshot list reload, for example) are traced as the UI's
+    api_trace.set_subsystem("ui")
 
 def str_schedule(schedule):
     html = f"<br>&emsp; {schedule.get_html()}"
@@ -102,8 +111,9 @@ def config_file_submit():
                 # logging.info(f"data {data}")
                 with open(sconfig.configfile, "w") as f:
                     f.write(changedtxt)
+                config_watch.config_watcher.notify()
                 msgs = f"Saved.  No first-pass syntax errors found.\nFile is {sconfig.configfile}."
-                msgs += f"\n\nChanges should be picked up by Snaptool within a minute."
+                msgs += f"\n\nChanges will be picked up by Snaptool right away."
                 return render_template('config_file_edit.html', 
                                    filetext=f"{changedtxt}", 
                                    msgtext=msgs)
@@ -122,6 +132,11 @@ def config_file_submit():
         html = traceback.format_exc()
         return render_template("error.html", message=f"error: {html}")
 
+@app.route("/metrics")
+def show_metrics():
+    # Prometheus text format, for scraping
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route("/log")
 def show_logs():
     try:
@@ -148,8 +163,8 @@ def show_actions_log():
 def snaptool_main_menu():
     try:
         app.logger.info(f"snaptool_main_menu rendering...")
-        q_size = background.background_q.qsize()
-        q = background.background_q.queue
+        q = background.pending_operations()
+        q_size = len(q)
         progress = get_logs()
         app.logger.info(f"got progress list: {progress}")
     except Exception as exc:
@@ -172,29 +187,31 @@ def snaptool_main_menu():
         html = f"{traceback.format_exc()}"
         return render_template("error.html", f"error: {html}")
 
-@app.get("/shutdownthread")
-def shutdown_thread():
-    shutdown_func = request.environ.get('werkzeug.server.shutdown')
-    shutdown_func()
-    return "Shutting down..."
-
 def stop_ui():
+    # shuts the server down and waits for it to stop, so the port can be reused right away
+    global ui_server
+    server = ui_server
+    if server is None:
+        return
     app.logger.warning(f"Shutting down flask...")
-    global sconfig
     try:
-        if sconfig:
-            url = f'http://127.0.0.1:{sconfig.flask_http_port}/shutdownthread'
-            print(f"in stop_ui, url: {url}")
-            resp = requests.get(url)
+        server.shutdown()
+        server.server_close()
     except Exception as exc:
         app.logger.error(f"While shutting down {exc}")
-    app.logger.warning(f"resp = {resp}")
+    ui_server = None
 
 def run_ui(snaptool_config=None):
-    global sconfig
+    global sconfig, ui_server
     sconfig = snaptool_config
-    kwargs = {'host': '0.0.0.0', 'port': sconfig.flask_http_port, 'threaded': True, 'use_reloader': False, 'debug': False}
-    flaskThread = threading.Thread(target=app.run, daemon=True, kwargs=kwargs)
+    try:
+        ui_server = make_server('0.0.0.0', sconfig.flask_http_port, app, threaded=True)
+    except OSError as exc:
+        app.logger.error(f"Unable to start status UI on port {sconfig.flask_http_port}: {exc}")
+        sconfig = None
+        return
+    flaskThread = threading.Thread(target=ui_server.serve_forever, kwargs={'poll_interval': 0.1}, daemon=True,
+                                   name="flask_ui")
     print("run_ui - Starting status UI\n")
     flaskThread.start()
     print("run_ui - UI Thread started\n")
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+
+# forecast.py - simulate a snaptool.yml schedule without a cluster
+#
+# Runs the scheduler (ScheduleTimeline and get_snaps_dict_by_fs, as the main loop does) over a time horizon,
+# applying the delete_old_snapshots retention rule after every create, and reports how many snapshots each
+# filesystem ends up holding, the snapshot operations (creates, uploads and deletes) per hour, and the largest
+# delete bursts.   Filesystems are assumed to start with no snaptool snapshots.   The snapshots_list and status
+# calls that go with them (inventory refreshes, retention sweeps, upload/delete progress polls) depend on how
+# long uploads and deletes take on the cluster, so they aren't counted.
+#
+# Filesystems that use the same schedule groups snap identically, so each distinct set of groups is simulated
+# once, on a single stand-in filesystem, and the results are scaled by the number of filesystems using it.
+
+import sys
+import copy
+import json
+import logging
+import datetime
+from collections import Counter, deque
+
+import snaptool
+
+log = logging.getLogger(__name__)
+
+SIM_FS = "forecast_fs"      # stand-in filesystem name used while simulating a schedule group signature
+
+
+class SignatureForecast(object):
+    # the simulated activity of one filesystem that uses a given set of schedule groups
+    def __init__(self, groupnames):
+        self.groupnames = groupnames
+        self.filesystems = []
+        self.creates = Counter()            # snap time -> creates (0 or 1 for one filesystem)
+        self.uploads = Counter()
+        self.deletes = Counter()
+        self.created_by_entry = Counter()   # entry name -> snaps created
+        self.held_by_entry = {}             # entry name -> snaps held at the end of the forecast
+
+    def total(self, counter):
+        return sum(counter.values())
+
+
+def schedule_signatures(schedules_dict):
+    # {(groupname, ...): [fs, ...]} - group names in schedules_dict order, which decides conflicts
+    fs_groups = {}
+    for sg in schedules_dict.values():
+        for fs in sg.filesystems:
+            fs_groups.setdefault(fs, []).append(sg.name)
+    signatures = {}
+    for fs, groupnames in fs_groups.items():
+        signatures.setdefault(tuple(groupnames), []).append(fs)
+    return signatures
+
+
+def _simulation_groups(schedules_dict, groupnames):
+    # fresh copies of the groups and entries, so the simulation doesn't disturb a live config's snap times
+    groups = []
+    for name in groupnames:
+        sg = snaptool.ScheduleGroup(name)
+        for entry in schedules_dict[name].entries:
+            entry_copy = copy.copy(entry)
+            entry_copy.nextsnap_dt = datetime.datetime.min
+            sg.entries.append(entry_copy)
+        sg.filesystems = [SIM_FS]
+        groups.append(sg)
+    return groups
+
+
+def simulate_signature(schedules_dict, groupnames, start, end):
+    result = SignatureForecast(groupnames)
+    groups = _simulation_groups(schedules_dict, groupnames)
+    retain = {entry.name: entry.retain for sg in groups for entry in sg.entries}
+    held = {name: deque() for name in retain}
+    timeline = snaptool.ScheduleTimeline(groups, start)
+    now_dt = start
+    while True:
+        snap_time, snapgroups = timeline.next_snapgroups(now_dt)
+        if snap_time >= end:
+            break
+        entry = snaptool.get_snaps_dict_by_fs(snapgroups, snap_time)[SIM_FS]
+        timeline.advance(snap_time)
+        result.creates[snap_time] += 1
+        result.created_by_entry[entry.name] += 1
+        if snaptool.upload_operation(entry.upload):
+            result.uploads[snap_time] += 1
+        # retention as in get_snaps_to_delete: keep the newest 'retain' snaps of the entry, delete the rest
+        held[entry.name].append(snap_time)
+        while len(held[entry.name]) > retain[entry.name]:
+            held[entry.name].popleft()
+            result.deletes[snap_time] += 1
+        now_dt = snap_time + datetime.timedelta(minutes=1)
+    result.held_by_entry = {name: len(snaps) for name, snaps in held.items()}
+    return result
+
+
+def run_forecast(schedules_dict, start, days):
+    end = start + datetime.timedelta(days=days)
+    forecasts = []
+    for groupnames, filesystems in schedule_signatures(schedules_dict).items():
+        forecast = simulate_signature(schedules_dict, groupnames, start, end)
+        forecast.filesystems = filesystems
+        forecasts.append(forecast)
+    return forecasts, end
+
+
+def _hour(dt):
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def cluster_activity(forecasts):
+    # cluster-wide {snap time: count} for creates, uploads and deletes, scaled by filesystems per signature
+    activity = {'creates': Counter(), 'uploads': Counter(), 'deletes': Counter()}
+    for forecast in forecasts:
+        scale = len(forecast.filesystems)
+        for name, counter in activity.items():
+            for snap_time, count in getattr(forecast, name).items():
+                counter[snap_time] += count * scale
+    return activity
+
+
+def hourly_activity(activity):
+    hourly = {}
+    for name, counter in activity.items():
+        for snap_time, count in counter.items():
+            hourly.setdefault(_hour(snap_time), Counter())[name] += count
+    return dict(sorted(hourly.items()))
+
+
+def summarize(forecasts, start, end):
+    activity = cluster_activity(forecasts)
+    hourly = hourly_activity(activity)
+    hours = max(1, round((end - start).total_seconds() / 3600))
+    operations = {hour: sum(c.values()) for hour, c in hourly.items()}
+    peak_hour = max(operations, key=operations.get) if operations else None
+    peak_delete_minute = max(activity['deletes'], key=activity['deletes'].get) if activity['deletes'] else None
+    hourly_deletes = {hour: c['deletes'] for hour, c in hourly.items() if c['deletes']}
+    peak_delete_hour = max(hourly_deletes, key=hourly_deletes.get) if hourly_deletes else None
+    totals = {name: sum(counter.values()) for name, counter in activity.items()}
+    filesystems = {}
+    for forecast in forecasts:
+        for fs in forecast.filesystems:
+            filesystems[fs] = {'schedules': list(forecast.groupnames),
+                               'creates': forecast.total(forecast.creates),
+                               'uploads': forecast.total(forecast.uploads),
+                               'deletes': forecast.total(forecast.deletes),
+                               'snapshots_at_end': sum(forecast.held_by_entry.values()),
+                               'snapshots_by_schedule': dict(forecast.held_by_entry)}
+    return {
+        'start': start.isoformat(), 'end': end.isoformat(),
+        'filesystems_count': len(filesystems), 'schedule_signatures': len(forecasts),
+        'totals': {**totals, 'snapshot_operations': sum(totals.values())},
+        'snapshot_operations_per_hour': {'average': round(sum(operations.values()) / hours, 2),
+                                         'peak': operations.get(peak_hour, 0),
+                                         'peak_hour': peak_hour.isoformat() if peak_hour else None},
+        'peak_delete_burst': {
+            'minute': {'time': peak_delete_minute.isoformat() if peak_delete_minute else None,
+                       'deletes': activity['deletes'].get(peak_delete_minute, 0)},
+            'hour': {'time': peak_delete_hour.isoformat() if peak_delete_hour else None,
+                     'deletes': hourly_deletes.get(peak_delete_hour, 0)}},
+        'filesystems': filesystems,
+    }
+
+
+def write_json(summary, out):
+    json.dump(summary, out, indent=2)
+    out.write("\n")
+
+
+def write_csv(summary, out):
+    # one row per filesystem
+    out.write("filesystem,schedules,creates,uploads,deletes,snapshots_at_end\n")
+    for fs, f in summary['filesystems'].items():
+        out.write(f"{fs},{' '.join(f['schedules'])},{f['creates']},{f['uploads']},{f['deletes']},"
+                  f"{f['snapshots_at_end']}\n")
+
+
+def write_hourly_csv(forecasts, out):
+    # one row per hour with any activity, cluster-wide
+    out.write("hour,creates,uploads,deletes,snapshot_operations\n")
+    for hour, c in hourly_activity(cluster_activity(forecasts)).items():
+        out.write(f"{hour.isoformat()},{c['creates']},{c['uploads']},{c['deletes']},{sum(c.values())}\n")
+
+
+def forecast_config(snaptool_config, days, start=None, output_format="json", out=sys.stdout):
+    # snaptool_config has its config loaded; no cluster connection is needed
+    snaptool_config.parse_fs_schedules()
+    start = (start or datetime.datetime.now()).replace(second=0, microsecond=0)
+    forecasts, end = run_forecast(snaptool_config.schedules_dict, start, days)
+    if output_format == "csv":
+        write_csv(summarize(forecasts, start, end), out)
+    elif output_format == "hourly-csv":
+        write_hourly_csv(forecasts, out)
+    else:
+        write_json(summarize(forecasts, start, end), out)
@@ -0,0 +1,177 @@
+# inventory.py - in-memory cache of the cluster snapshot list
+#
+# The full snapshots_list can be many megabytes on a large cluster.   The scheduler, the background
+# thread and the UI all read from one SnapshotInventory, which is loaded from the cluster on an interval
+# and kept current in between by applying snaptool's own creates, deletes and status updates as deltas.
+
+import threading
+import time
+import datetime
+import logging
+
+log = logging.getLogger(__name__)
+
+DEFAULT_REFRESH_INTERVAL = 300     # seconds between full reloads of the snapshot list
+
+
+def snap_schedule_name(snap_name):
+    # snaptool snapshot names are <schedname>.<yymmddhhmm>; return schedname, or None for other snaps
+    parts = snap_name.split('.')
+    if len(parts) == 2 and parts[1].isdigit() and len(parts[1]) == 10:
+        return parts[0]
+    return None
+
+
+class SnapshotInventory(object):
+    def __init__(self, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self._lock = threading.Lock()           # protects the snapshot dicts and indexes
+        self._refresh_lock = threading.Lock()   # only one full reload from the cluster at a time
+        self.refresh_interval = refresh_interval
+        self.source = None          # callable returning the cluster snapshot list
+        self.loaded_at = None       # time.monotonic() of last full load
+        self.stale = True
+        self.full_refreshes = 0
+        self.deltas_applied = 0
+        self._snaps = {}            # (fs, snapname) -> snapshot dict
+        self._by_fs = {}            # fs -> {snapname: snapshot dict}
+        self._by_schedule = {}      # schedule name -> {(fs, snapname): snapshot dict}
+        self._deltas_during_refresh = None
+
+    def set_source(self, source):
+        # source is called with no arguments and returns the list (or dict) from snapshots_list
+        self.source = source
+        self.invalidate("new cluster connection")
+
+    def invalidate(self, reason):
+        if not self.stale:
+            log.info(f"Snapshot inventory marked stale: {reason}")
+        self.stale = True
+
+    def needs_refresh(self):
+        if self.stale or self.loaded_at is None:
+            return True
+        return time.monotonic() - self.loaded_at > self.refresh_interval
+
+    def refresh(self, force=True, source=None):
+        # source overrides the configured source for this refresh (the background progress monitor
+        # uses its own cluster object, without call_weka_api retries)
+        source = source or self.source
+        if source is None:
+            raise RuntimeError("Snapshot inventory has no cluster connection")
+        with self._refresh_lock:
+            if not force and not self.needs_refresh():
+                return      # another thread refreshed it while we waited
+            with self._lock:
+                self._deltas_during_refresh = []
+                self.stale = False      # an invalidate() during the fetch will leave it stale again
+            try:
+                snapshot_list = source()
+            except Exception:
+                with self._lock:
+                    self._deltas_during_refresh = None
+                    self.stale = True
+                raise
+            self.load(snapshot_list, clear_stale=False)
+
+    def load(self, snapshot_list, clear_stale=True):
+        # replace the inventory with a full snapshot list from the cluster
+        if isinstance(snapshot_list, dict):
+            snapshot_list = snapshot_list.values()
+        with self._lock:
+            self._snaps, self._by_fs, self._by_schedule = {}, {}, {}
+            for s in snapshot_list:
+                self._add(s)
+            # creates/deletes that happened while the list was being fetched may not be in it
+            for delta in (self._deltas_during_refresh or []):
+                delta()
+            self._deltas_during_refresh = None
+            self.loaded_at = time.monotonic()
+            if clear_stale:
+                self.stale = False
+            self.full_refreshes += 1
+            count = len(self._snaps)
+        log.info(f"Snapshot inventory loaded: {count} snapshots")
+
+    def _ensure_fresh(self):
+        if self.needs_refresh():
+            self.refresh(force=False)
+
+    def _add(self, snap):
+        fs, name = snap['filesystem'], snap['name']
+        self._snaps[(fs, name)] = snap
+        self._by_fs.setdefault(fs, {})[name] = snap
+        schedname = snap_schedule_name(name)
+        if schedname is not None:
+            self._by_schedule.setdefault(schedname, {})[(fs, name)] = snap
+
+    def _remove(self, fs, name):
+        snap = self._snaps.pop((fs, name), None)
+        if snap is None:
+            return False
+        self._by_fs.get(fs, {}).pop(name, None)
+        schedname = snap_schedule_name(name)
+        if schedname is not None:
+            self._by_schedule.get(schedname, {}).pop((fs, name), None)
+        return True
+
+    def _apply(self, delta):
+        with self._lock:
+            result = delta()
+            if self._deltas_during_refresh is not None:
+                self._deltas_during_refresh.append(delta)
+            self.deltas_applied += 1
+        return result
+
+    def apply_create(self, fs, name, access_point='', snap=None):
+        if not isinstance(snap, dict) or 'name' not in snap or 'filesystem' not in snap:
+            now_utc = datetime.datetime.now(datetime.timezone.utc)
+            snap = {'filesystem': fs, 'name': name, 'accessPoint': access_point,
+                    'creationTime': now_utc.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    'stowStatus': 'NONE', 'objectProgress': 'N/A',
+                    'localStowInfo': {'locator': '', 'stowStatus': 'NONE', 'stowProgress': 'N/A'},
+                    'remoteStowInfo': {'locator': '', 'stowStatus': 'NONE', 'stowProgress': 'N/A'}}
+        self._apply(lambda: self._add(snap))
+
+    def apply_update(self, snap):
+        # a fresher status for one snapshot, from a filtered snapshots_list
+        if isinstance(snap, dict) and 'name' in snap and 'filesystem' in snap:
+            self._apply(lambda: self._add(snap))
+
+    def apply_delete(self, fs, name):
+        # returns True if the snapshot was in the inventory
+        return self._apply(lambda: self._remove(fs, name))
+
+    def lookup(self, fs, name):
+        # current entry for one snapshot, without checking if a refresh is due
+        with self._lock:
+            return self._snaps.get((fs, name))
+
+    def contains(self, fs, name):
+        self._ensure_fresh()
+        with self._lock:
+            return (fs, name) in self._snaps
+
+    def get_snapshots(self):
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._snaps.values())
+
+    def name_set(self, wait=True):
+        # wait=False returns what's loaded now, rather than waiting for a reload another thread is doing
+        if wait or self.loaded_at is None or not self._refresh_lock.locked():
+            self._ensure_fresh()
+        with self._lock:
+            return set(self._snaps.keys())
+
+    def snapshots_for_fs(self, fs):
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._by_fs.get(fs, {}).values())
+
+    def snapshots_for_schedule(self, schedname):
+        self._ensure_fresh()
+        with self._lock:
+            return list(self._by_schedule.get(schedname, {}).values())
+
+
+snapshot_inventory = SnapshotInventory()
@@ -0,0 +1,177 @@
+# metrics.py - counters, histograms and gauges for the status UI's /metrics page (Prometheus text format)
+#
+# No client library is needed.   Each module defines the metrics for its own code with counter(),
+# histogram() and gauge(), and updates them where things happen.   An update takes one uncontended lock
+# for a dict lookup and an add or two, which is nothing next to the API calls and operations being
+# measured; everything else (cumulative buckets, formatting, gauge callbacks) happens when /metrics is read.
+
+import bisect
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+API_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+OPERATION_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1800, 3600, 7200, 14400)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}       # tuple of label values -> value
+
+    def samples(self):
+        # [(sample name, label names, label values, value), ...]
+        with self._lock:
+            items = list(self._values.items())
+        return [(self.name, self.labelnames, labels, value) for labels, value in sorted(items)]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for name, labelnames, labels, value in self.samples():
+            lines.append(f"{name}{_format_labels(labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+
+class Gauge(Metric):
+    # either set() directly, or given a callback that returns the current value (or a dict of
+    # {(label values): value}) when /metrics is read
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def set(self, value, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def samples(self):
+        if self.callback is None:
+            return super().samples()
+        try:
+            values = self.callback()
+        except Exception as exc:
+            log.debug(f"metric {self.name} unavailable: {exc}")
+            return []
+        if values is None:
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [(self.name, self.labelnames, labels, value) for labels, value in sorted(values.items())]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=API_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)     # the first bucket with le >= value
+        with self._lock:
+            hist = self._values.get(labelvalues)
+            if hist is None:
+                hist = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            hist[0][index] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, (list(h[0]), h[1], h[2])) for labels, h in self._values.items()]
+        result = []
+        bucket_labelnames = self.labelnames + ("le",)
+        for labels, (counts, total, count) in sorted(items):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                result.append((f"{self.name}_bucket", bucket_labelnames, labels + (_format_value(float(bound)),),
+                               cumulative))
+            result.append((f"{self.name}_sum", self.labelnames, labels, total))
+            result.append((f"{self.name}_count", self.labelnames, labels, count))
+        return result
+
+
+class Registry(object):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        # a module imported twice (snaptool runs as __main__, and forecast imports it again) defines its
+        # metrics twice; both get the first one
+        with self._lock:
+            existing = self.metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                    raise ValueError(f"Metric {metric.name} is already registered as a different metric")
+                return existing
+            self.metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return registry.register(Counter(name, help_text, labelnames))
+
+
+def gauge(name, help_text, labelnames=(), callback=None):
+    return registry.register(Gauge(name, help_text, labelnames, callback))
+
+
+def histogram(name, help_text, labelnames=(), buckets=API_BUCKETS):
+    return registry.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def render():
+    return registry.render()
+
+
+# updated by api_trace.call_api(), which every API call goes through
+api_calls = counter("snaptool_api_calls_total", "Weka API calls made, by method", ["method"])
+api_errors = counter("snaptool_api_errors_total", "Weka API calls that raised an error, by method", ["method"])
+api_latency = histogram("snaptool_api_call_seconds", "Weka API call latency, by method", ["method"])
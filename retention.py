@@ -0,0 +1,102 @@
+# retention.py - find snapshots beyond their schedule's retain count, in a thread of its own
+#
+# A retention sweep reads the whole snapshot inventory (reloading it from the cluster if it's stale) and
+# queues background deletes.   On a large cluster that can take long enough to delay the next scheduled
+# creates, so the main loop only asks for a sweep - after creates, and after a config change - and the
+# sweeper thread runs it.   Sweeps start at most once per min_interval seconds; requests made meanwhile
+# are folded into the next sweep, which always uses the most recently requested schedules.
+
+import copy
+import time
+import logging
+import threading
+import metrics
+import api_trace
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MIN_INTERVAL = 60      # seconds between the starts of retention sweeps
+
+sweep_seconds = metrics.histogram("snaptool_retention_sweep_seconds", "Time retention sweeps took",
+                                  buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 120, 300))
+sweep_deletes = metrics.counter("snaptool_retention_deletes_queued_total", "Deletes queued by retention sweeps")
+
+
+def snapshot_groups(schedules_dict):
+    # copies of the schedule groups with their entries and filesystems as they are now.   The sweep can't use
+    # the live groups: the main thread re-sorts a group's entries after every create (other threads see a
+    # list as empty while it's being sorted) and a reload replaces entries and filesystems one after the other
+    groups = {}
+    for name, sg in schedules_dict.items():
+        sg_copy = copy.copy(sg)
+        sg_copy.entries = tuple(sg.entries)
+        sg_copy.filesystems = tuple(sg.filesystems)
+        groups[name] = sg_copy
+    return groups
+
+
+class RetentionSweeper(object):
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self.requested = threading.Event()
+        self.sweeps = 0
+        self.running = False
+        self.last_sweep_start = None    # time.monotonic() of the last sweep's start
+        self.last_sweep_seconds = None
+        self.last_sweep_queued = 0      # deletes queued by the last sweep
+        self.last_error = None
+        self._lock = threading.Lock()
+        self._work = None               # (cluster connection, schedules dict) for the next sweep
+        self._reasons = []
+        self._thread = None
+
+    def request(self, cluster_connection, schedules_dict, reason):
+        # returns right away; the sweep runs in the sweeper thread
+        if cluster_connection is None or schedules_dict is None:
+            return
+        groups = snapshot_groups(schedules_dict)     # here, in the main thread that changes the groups
+        with self._lock:
+            self._work = (cluster_connection, groups)
+            self._reasons.append(reason)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="retention_sweep")
+                self._thread.start()
+        self.requested.set()
+
+    def _run(self):
+        api_trace.set_subsystem("retention")
+        while True:
+            self.requested.wait()
+            if self.last_sweep_start is not None:
+                delay = self.last_sweep_start + self.min_interval - time.monotonic()
+                if delay > 0:
+                    log.debug(f"Retention sweep in {round(delay, 1)}s")
+                    time.sleep(delay)
+            with self._lock:
+                self.requested.clear()
+                work, self._work = self._work, None
+                reasons, self._reasons = self._reasons, []
+            if work is not None:    # None if an earlier sweep already picked up this request
+                self.sweep(*work, reasons)
+
+    def sweep(self, cluster_connection, schedules_dict, reasons=()):
+        self.running = True
+        self.last_sweep_start = time.monotonic()
+        self.last_sweep_queued = 0
+        try:
+            self.last_sweep_queued = cluster_connection.delete_old_snapshots(schedules_dict)
+            self.last_error = None
+        except Exception as exc:
+            self.last_error = f"{exc}"
+            log.error(f"Retention sweep failed: {exc}")
+        finally:
+            self.last_sweep_seconds = round(time.monotonic() - self.last_sweep_start, 3)
+            sweep_seconds.observe(time.monotonic() - self.last_sweep_start)
+            sweep_deletes.inc(amount=self.last_sweep_queued)
+            self.sweeps += 1
+            self.running = False
+        log.info(f"Retention sweep ({', '.join(sorted(set(reasons)))}) took {self.last_sweep_seconds}s,"
+                 f" {self.last_sweep_queued} deletes queued")
+
+
+retention_sweeper = RetentionSweeper()
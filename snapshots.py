@@ -2,6 +2,7 @@
 # 6/2021
 #
 
+import random
 import logging
 import calendar
 from datetime import datetime
@@ -26,6 +27,24 @@ RETAIN_MIN = 99
 # RETAIN_LIIMIT is the highest value RETAIN_MAX can  be set to
 RETAIN_LIMIT = 3000
 
+# Daily and interval schedules are compiled into a bitmap with one bit per minute of the week
+# (bit weekday * MINUTES_PER_DAY + minute of day, Monday = 0), monthly schedules into one bit per minute
+# of a calendar year.   The next snap time is then the next set bit at or after now.
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+def _next_set_bit(bits, index, size):
+    # offset from index to the next set bit at or after index, wrapping around at size; None if no bits set
+    if bits == 0:
+        return None
+    following = bits >> index
+    if following:
+        return (following & -following).bit_length() - 1
+    return size - index + (bits & -bits).bit_length() - 1
+
+def _minute_of_day(t):
+    return t.hour * 60 + t.minute
+
 def is_everyday(every):
     return str(every).lower() == "day"
 
@@ -209,6 +228,7 @@ def parse_schedule_entry(schedule_groupname, schedule_name, sched_spec):
         log.error(f"   Ignoring entry.")
         return None, f"Schedule {name}: invalid 'every:' spec '{every}' spec"
     entry.groupname = (schedule_groupname or schedule_name)
+    entry.spec = dict(sched_spec)       # as written in the config, to tell if it changed on a reload
     return entry, None
 
 class _BaseScheduleEntry(object):
@@ -218,6 +238,7 @@ class _BaseScheduleEntry(object):
 
     def __init__(self, name, retain, at, upload=False, sort_priority=9999):
         self.groupname = None
+        self.spec = None
         self.name = name
         self.retain = retain
         self.upload = upload
@@ -239,6 +260,14 @@ class _BaseScheduleEntry(object):
         # should never be called
         return datetime.min
 
+    def next_snaptime(self, now):
+        # first snap time at or after now (to the minute), from the compiled bitmap
+        return datetime.min
+
+    def next_snaptime_rrule(self, now):
+        # the same, computed with dateutil rrule - the reference the bitmaps are tested against
+        return datetime.min
+
 class MonthlyScheduleEntry(_BaseScheduleEntry):
     def __str__(self):
         return "Monthly:" + _BaseScheduleEntry.__str__(self) + f":months={self.month_list}:day={self.day} "
@@ -246,6 +275,7 @@ class MonthlyScheduleEntry(_BaseScheduleEntry):
     def __init__(self, name, month_list, retain, at, day, upload, sort_priority=10):
         self.day = day
         self.month_list = month_list
+        self._year_bitmaps = {}     # year -> minute of year bitmap
         _BaseScheduleEntry.__init__(self, name, retain, at, upload, sort_priority)
 
     def get_html(self):
@@ -257,6 +287,42 @@ class MonthlyScheduleEntry(_BaseScheduleEntry):
     def get_html_type(self):
         return "Monthly"
 
+    def year_bitmap(self, year):
+        if year not in self._year_bitmaps:
+            bits = 0
+            for month in self.month_list:
+                # day past the end of the month snaps on the last day, like relativedelta(day=31)
+                day = min(self.day, calendar.monthrange(year, month)[1])
+                day_of_year = datetime(year, month, day).timetuple().tm_yday
+                bits |= 1 << ((day_of_year - 1) * MINUTES_PER_DAY + _minute_of_day(self.at))
+            self._year_bitmaps[year] = bits
+        return self._year_bitmaps[year]
+
+    def next_snaptime(self, now):
+        now = now.replace(second=0, microsecond=0)
+        year_start = datetime(now.year, 1, 1)
+        index = (now.timetuple().tm_yday - 1) * MINUTES_PER_DAY + _minute_of_day(now)
+        following = self.year_bitmap(now.year) >> index
+        if following:
+            return now + relativedelta(minutes=(following & -following).bit_length() - 1)
+        bits = self.year_bitmap(now.year + 1)
+        return year_start.replace(year=now.year + 1) + relativedelta(minutes=(bits & -bits).bit_length() - 1)
+
+    def next_snaptime_rrule(self, now):
+        now = now.replace(second=0, microsecond=0)
+        # use first of month because rrule skips missing dates like feb 31 and we want those months
+        target_datetime = datetime(now.year, now.month, 1, self.at.hour, self.at.minute)
+        log.debug(f"target_datetime: {target_datetime}")
+        candidates = list(rrule(MONTHLY, dtstart=target_datetime, bymonth=self.month_list, count=2))
+        # set day via relative delta to properly handle end of month cases
+        day_rel = relativedelta(day=self.day)
+        log.debug(f"     candidates: {candidates}")
+        candidates = [c+day_rel for c in candidates]
+        if candidates[0] < now:
+            return candidates[1]
+        else:
+            return candidates[0]
+
     def calc_next_snaptime(self, now):
         log.debug(f" (monthly) now={now}, self.nextsnap_dt={self.nextsnap_dt}")
         if self.retain == 0:    # force sort to the end of time
@@ -266,18 +332,7 @@ class MonthlyScheduleEntry(_BaseScheduleEntry):
         now = now.replace(second=0, microsecond=0)
         if self.nextsnap_dt < now:
             log.debug(f" computing new monthly target...")
-            # use first of month because rrule skips missing dates like feb 31 and we want those months
-            target_datetime = datetime(now.year, now.month, 1, self.at.hour, self.at.minute)
-            log.debug(f"target_datetime: {target_datetime}")
-            candidates = list(rrule(MONTHLY, dtstart=target_datetime, bymonth=self.month_list, count=2))
-            # set day via relative delta to properly handle end of month cases
-            day_rel = relativedelta(day=self.day)
-            log.debug(f"     candidates: {candidates}")
-            candidates = [c+day_rel for c in candidates]
-            if candidates[0] < now:
-                self.nextsnap_dt = candidates[1]
-            else:
-                self.nextsnap_dt = candidates[0]
+            self.nextsnap_dt = self.next_snaptime(now)
         log.debug(f"    returning self.nextsnap_dt={self.nextsnap_dt}")
         return self.nextsnap_dt
 
@@ -289,6 +344,7 @@ class DailyScheduleEntry(_BaseScheduleEntry):
     def __init__(self, name, weekday_list, retain, at, upload, sort_priority=50):
         self.weekday_list = weekday_list
         _BaseScheduleEntry.__init__(self, name, retain, at, upload, sort_priority)
+        self.week_bitmap = self.compile_week_bitmap()
 
     def get_html(self):
         html = super().get_html()
@@ -298,7 +354,19 @@ class DailyScheduleEntry(_BaseScheduleEntry):
 
     def get_html_type(self):
         return "Daily"
-        
+
+    def compile_week_bitmap(self):
+        bits = 0
+        for weekday in self.weekday_list:
+            bits |= 1 << (weekday * MINUTES_PER_DAY + _minute_of_day(self.at))
+        return bits
+
+    def next_snaptime(self, now):
+        now = now.replace(second=0, microsecond=0)
+        offset = _next_set_bit(self.week_bitmap, now.weekday() * MINUTES_PER_DAY + _minute_of_day(now),
+                               MINUTES_PER_WEEK)
+        return now + relativedelta(minutes=offset)
+
     def find_next_daily_snaptime(self, now, hour, minute):
         target_datetime = datetime(now.year, now.month, now.day, hour, minute)
         candidates = list(rrule(DAILY, dtstart=target_datetime, byweekday=self.weekday_list, count=2))
@@ -308,6 +376,10 @@ class DailyScheduleEntry(_BaseScheduleEntry):
         else:
             return candidates[0]
 
+    def next_snaptime_rrule(self, now):
+        now = now.replace(second=0, microsecond=0)
+        return self.find_next_daily_snaptime(now, self.at.hour, self.at.minute)
+
     def calc_next_snaptime(self, now):
         log.debug(f" (daily) now={now}, self.nextsnap_dt={self.nextsnap_dt}")
         if self.retain == 0:    # force sort to the end of time
@@ -317,7 +389,7 @@ class DailyScheduleEntry(_BaseScheduleEntry):
         now = now.replace(second=0, microsecond=0)
         if self.nextsnap_dt < now:
             log.debug(f"(daily), now > next snap")
-            self.nextsnap_dt = self.find_next_daily_snaptime(now, self.at.hour, self.at.minute)
+            self.nextsnap_dt = self.next_snaptime(now)
         log.debug(f"(daily), returning self.nextsnap_dt={self.nextsnap_dt}")
         return self.nextsnap_dt
 
@@ -340,31 +412,49 @@ class IntervalScheduleEntry(DailyScheduleEntry):
 
     def get_html_type(self):
         return "Interval"
-        
-    def calc_next_snaptime(self, now):
+
+    def compile_week_bitmap(self):
+        first, last = _minute_of_day(self.at), _minute_of_day(self.until)
+        if first > last:
+            return None     # until: before at: - left to the rrule computation, which handles it its own way
+        day_bits = 0
+        for minute in range(first, last + 1, self.interval):
+            day_bits |= 1 << minute
+        bits = 0
+        for weekday in self.weekday_list:
+            bits |= day_bits << (weekday * MINUTES_PER_DAY)
+        return bits
+
+    def next_snaptime(self, now):
+        if self.week_bitmap is None:
+            return self.next_snaptime_rrule(now)
+        return DailyScheduleEntry.next_snaptime(self, now)
+
+    def next_snaptime_rrule(self, now):
         # get rid of seconds
         now = now.replace(second=0, microsecond=0)
-        if self.retain == 0:
-            log.warning(f"Snapshot {self.name} has retain=0")
-            self.nextsnap_dt = datetime.max
-            return self.nextsnap_dt
         # find next valid date containing self.until
         until_dt = self.find_next_daily_snaptime(now, self.until.hour, self.until.minute)
         start = datetime(until_dt.year, until_dt.month, until_dt.day, self.at.hour, self.at.minute)
         log.debug(f"(Interval) now:{now} start:{start} until:{until_dt}")
         if now <= start:  # no need to list candidates
-            self.nextsnap_dt = start
-        else:
-            # find the candidate that is within <interval> minutes of now
-            # calculation is based on start, so easiest method is generate all times between start and now + interval
-            # rrule seems pretty optimized and plenty fast enough given size of problem.
-            max_from_now = min(until_dt, now + relativedelta(minutes=+self.interval - 1))
-            log.debug(f"(Interval) max_from_now: {max_from_now}")
-            candidates = list(rrule(MINUTELY, dtstart=start, interval=self.interval, until=max_from_now))
-            candidate = candidates[-1]
-            if candidate < now:  # last candidate for today already passed, go to next day's start
-                candidate = self.find_next_daily_snaptime(start + relativedelta(days=+1), start.hour, start.minute)
-            self.nextsnap_dt = candidate
+            return start
+        # find the candidate that is within <interval> minutes of now
+        # calculation is based on start, so easiest method is generate all times between start and now + interval
+        max_from_now = min(until_dt, now + relativedelta(minutes=+self.interval - 1))
+        log.debug(f"(Interval) max_from_now: {max_from_now}")
+        candidates = list(rrule(MINUTELY, dtstart=start, interval=self.interval, until=max_from_now))
+        candidate = candidates[-1]
+        if candidate < now:  # last candidate for today already passed, go to next day's start
+            candidate = self.find_next_daily_snaptime(start + relativedelta(days=+1), start.hour, start.minute)
+        return candidate
+
+    def calc_next_snaptime(self, now):
+        if self.retain == 0:
+            log.warning(f"Snapshot {self.name} has retain=0")
+            self.nextsnap_dt = datetime.max
+            return self.nextsnap_dt
+        self.nextsnap_dt = self.next_snaptime(now)
         return self.nextsnap_dt
 
 def _test_result_message(msg, always_print=False):
@@ -378,8 +468,9 @@ def _run_schedule_test(test_name, entry, test_time, expected):
     _test_result_message(f"test: {test_name}, schedule: {entry}", always_print)
     _test_result_message(f"      now: {test_time} -- expected: {expected}", always_print)
     result = entry.calc_next_snaptime(test_time)
+    reference = entry.next_snaptime_rrule(test_time)
     success = "FAILED !!!!"
-    if str(result) == expected:
+    if str(result) == expected and (entry.retain == 0 or reference == result):
         success = "ok"
         _test_result_message(f"{'':<31}-- nextsnap: {result}   --   {success}", always_print)
     else:
@@ -453,6 +544,52 @@ def run_schedule_tests(raise_expected_errors=True):
        log.info(f"(Expected error) Exception for I-everyday-parsetime parsing 256 {exc}")
     log.info(f"Snapshots schedule tests complete")
 
+def _differential_test_entries():
+    return [
+        MonthlyScheduleEntry("M-Jan-2-8am", _parse_months('Jan'), 5, _parse_time("8am"), 2, False),
+        MonthlyScheduleEntry("M-Feb-31-9:05am", _parse_months('Feb'), 5, _parse_time("9:05am"), 31, False),
+        MonthlyScheduleEntry("M-everymonth-31-7am", _parse_months('month'), 5, _parse_time("7am"), 31, False),
+        MonthlyScheduleEntry("M-every3-30-0000", _parse_months('Jan,Apr,Jul,Oct'), 5, _parse_time("0000"), 30, False),
+        DailyScheduleEntry("D-Mon-9am", _parse_days('Mon'), 4, _parse_time("9am"), False),
+        DailyScheduleEntry("D-day-2359", _parse_days('day'), 4, _parse_time("2359"), False),
+        DailyScheduleEntry("D-SatSun-0000", _parse_days('Sat,Sun'), 4, _parse_time("0000"), False),
+        IntervalScheduleEntry("I-MonWed-0903-1700-10min", _parse_days('Mon,Wed'), 4,
+                              _parse_time("9:03am"), _parse_time("5pm"), 10, False),
+        IntervalScheduleEntry("I-Mon-Fri-0905-1700-60min", _parse_days('Mon,Tue,Wed,Thu,Fri'), 4,
+                              _parse_time("9:05am"), _parse_time("5pm"), 60, False),
+        IntervalScheduleEntry("I-TueSat-0000-2359-45min", _parse_days('Tue,Sat'), 4,
+                              _parse_time("0000"), _parse_time("2359"), 45, False),
+        IntervalScheduleEntry("I-Sun-2300-2359-1min", _parse_days('Sun'), 4,
+                              _parse_time("11pm"), _parse_time("2359"), 1, False),
+    ]
+
+def run_schedule_differential_tests(year=2024):
+    # walk every snap time s of each test entry through a full year (plus the turn of the next one), checking
+    # the bitmap next_snaptime() against the rrule reference at the minute after the previous snap, a random
+    # point in the gap before s, one second before s, at s itself, and at the end of s's minute
+    log.info(f"Snapshots differential tests starting ({year})")
+    rng = random.Random(year)   # the same points every run, so a failure can be reproduced
+    failures = 0
+    end = datetime(year + 1, 1, 2)
+    for entry in _differential_test_entries():
+        t = datetime(year, 1, 1)
+        checked = 0
+        while t < end and failures < 10:
+            s = entry.next_snaptime_rrule(t)
+            check_times = [t, s - relativedelta(seconds=1), s, s + relativedelta(seconds=59)]
+            gap_seconds = int((s - t).total_seconds())
+            if gap_seconds > 0:
+                check_times.append(t + relativedelta(seconds=rng.randrange(gap_seconds)))
+            for check_time in check_times:
+                result, reference = entry.next_snaptime(check_time), entry.next_snaptime_rrule(check_time)
+                checked += 1
+                if result != reference:
+                    failures += 1
+                    log.error(f"Differential test FAILED for {entry}: now={check_time} bitmap={result} rrule={reference}")
+            t = s + relativedelta(minutes=1)
+        log.debug(f"   {entry.name}: {checked} times checked")
+    log.info(f"Snapshots differential tests complete: {failures} failures")
+    return failures == 0
 
 if __name__ == "__main__":
     filler = f"{'':-<35}"
@@ -464,4 +601,5 @@ if __name__ == "__main__":
     console_handler.setFormatter(logging.Formatter(FORMAT))
     log.addHandler(console_handler)
     run_schedule_tests()
+    run_schedule_differential_tests()
     print("\n")
@@ -6,11 +6,15 @@
 # updated for new scheduling - Bruce Clagett
 
 from operator import attrgetter, itemgetter
+from collections import deque
+import heapq
 import os
 import sys
 import argparse
 import platform
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 # import importlib_metadata as importmeta
 
 from wekalib import __version__ 
@@ -29,6 +33,11 @@ import wekalib.signals as signals
 import wekalib.wekacluster as wekacluster
 import snapshots
 import background
+import inventory
+import config_watch
+import retention
+import metrics
+import api_trace
 import flask_ui
 from contextlib import contextmanager
 
@@ -40,6 +49,20 @@ actions_log = logging.getLogger("snapshot_actions_log")
 actions_log_file = "snaptool.log"
 actions_log_resolved_file = None
 
+MAX_WAIT_SLICE = 60        # seconds; the longest wait before checking the wall clock again
+LATENESS_WARNING = 5.0     # seconds late for a scheduled minute's creates to start before warning
+LATENESS_HISTORY = 1440    # ticks of schedule lateness kept
+DEFAULT_WARMUP_SECONDS = 10     # seconds before each scheduled minute to check the connection and prepare
+
+lateness_seconds = metrics.histogram("snaptool_schedule_lateness_seconds",
+                                     "Time from each scheduled minute to its snapshot creates starting",
+                                     buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60))
+last_lateness_seconds = metrics.gauge("snaptool_schedule_last_lateness_seconds",
+                                      "Schedule lateness of the most recent scheduled minute")
+
+# the libyaml loader, when pyyaml was built with it, parses a large config many times faster
+YAML_LOADER = getattr(yaml, 'CBaseLoader', yaml.BaseLoader)
+
 running_in_docker = os.getenv('IN_DOCKER_CONTAINER', 'NO')
 running_as_service = os.getenv('LAUNCHED_BY_SYSTEMD', 'NO')
 
@@ -70,6 +93,9 @@ def parse_snaptool_args():
     # Also prints "Connection Succeeded" or "Connection Failed"
     argparser.add_argument("--test-connection-only", dest="test_connection_only",
                            action='store_true', default=False, help=argparse.SUPPRESS)
+    argparser.add_argument("--test-schedules", dest="test_schedules", action='store_true', default=False,
+                           help="run the schedule self tests, including a full-year check of every snap time "
+                                "against the rrule reference, and exit with 1 if any fail")
     argparser.add_argument("-p", "--http-port", dest="http_port", default=8090,
                             help="http port to use for status ui webserver.   Use 0 to disable")
     argparser.add_argument("--access-point-format", dest="access_point_format", default="@GMT-%Y.%m.%d-%H.%M.%S",
@@ -83,6 +109,31 @@ def parse_snaptool_args():
     argparser.add_argument("--no-edit", dest="no_edit", default=False, action='store_true',
                            help="whether to allow config file editing in the UI.  Default is True"
                            )
+    argparser.add_argument("--intent-log", dest="intent_log", default="text", choices=["text", "sqlite"],
+                           help="storage for the upload/delete intent log.  'sqlite' imports an existing text log")
+    argparser.add_argument("--intent-log-sync", dest="intent_log_sync", default="batch",
+                           choices=background.INTENT_LOG_DURABILITY,
+                           help="when intent log records are fsync'ed: none, once per batch of records (default), "
+                                "or after every record")
+    argparser.add_argument("--intent-log-batch-window", dest="intent_log_batch_window", type=float,
+                           default=background.DEFAULT_INTENT_LOG_BATCH_WINDOW * 1000, metavar="MS",
+                           help="milliseconds a batch of intent log records waits for more records to join it "
+                                "before its fsync, with --intent-log-sync batch (default 1; 0 to not wait)")
+    argparser.add_argument("--api-trace", dest="api_trace", default=None, metavar="FILENAME",
+                           help="write a JSON line for each cluster API call to FILENAME in the logs directory")
+    argparser.add_argument("--api-trace-sample", dest="api_trace_sample", default=1.0, type=float,
+                           help="fraction of successful API calls to trace (errors and retries always are)")
+    argparser.add_argument("--api-trace-max-mb", dest="api_trace_max_mb", default=50, type=int,
+                           help="size in MB at which the API trace file is rotated")
+    argparser.add_argument("--api-trace-backups", dest="api_trace_backups", default=5, type=int,
+                           help="number of rotated API trace files to keep")
+    argparser.add_argument("--forecast", dest="forecast", default=None, type=int, metavar="DAYS",
+                           help="simulate the configured schedules for DAYS days without a cluster, print a summary"
+                                " of snapshot counts, snapshot creates/uploads/deletes per hour (not counting the"
+                                " snapshots_list and status calls that go with them) and delete bursts, and exit")
+    argparser.add_argument("--forecast-format", dest="forecast_format", default="json",
+                           choices=["json", "csv", "hourly-csv"],
+                           help="--forecast output: json summary, csv per filesystem, or csv per hour")
     args = argparser.parse_args()
 
     if args.version:
@@ -133,6 +184,13 @@ def setup_actions_log():
     # from other logging), so don't propagate to root logger
     actions_log.propagate = False
 
+def setup_api_trace(args):
+    if args.api_trace:
+        filename = background.create_log_dir_file(args.api_trace)
+        api_trace.api_tracer.configure(filename, sample_rate=args.api_trace_sample,
+                                       max_bytes=args.api_trace_max_mb * 1024 * 1024,
+                                       backup_count=args.api_trace_backups)
+
 def setup_logging_initial():
     syslog_format = \
         "%(process)5s: %(levelname)-7s:%(filename)-15ss:%(lineno)4d:%(funcName)s(): %(message)s"
@@ -223,6 +281,17 @@ def _parse_bool(bool_str):
         log.error(f"Assuming False")
         return False
 
+def _parse_positive_int(int_str, setting_name, default, minimum=1):
+    try:
+        result = int(int_str)
+    except (TypeError, ValueError):
+        log.error(f"Invalid snaptool setting {setting_name}: '{int_str}' should be an int; using {default}")
+        return default
+    if result < minimum:
+        log.error(f"Invalid snaptool setting {setting_name}: {result} should be at least {minimum}; using {default}")
+        return default
+    return result
+
 def _parse_check_top_level(args, config):
     msg = ''
     if 'cluster' in config:
@@ -263,6 +332,7 @@ class ClusterConnection(object):
         self.verify_cert = cert_check
         self.mgmt_port = mgmt_port
         self.connected_since = datetime.datetime.max
+        self._reconnect_lock = threading.Lock()
 
     def connect(self):
         connected = False
@@ -278,6 +348,7 @@ class ClusterConnection(object):
             self.weka_cluster_name = self.weka_cluster.name
             self.connected_since = now()
             connected = self.weka_cluster
+            inventory.snapshot_inventory.set_source(self.list_cluster_snapshots)
         except BaseException as excinst:
             otherException = True
             msg2 = f"      ERROR {excinst}"
@@ -303,13 +374,25 @@ class ClusterConnection(object):
         else:
             return False
 
+    def reconnect(self, failed_cluster, reason):
+        # creates run in parallel, so only the first thread to see a failure on a cluster object reconnects
+        with self._reconnect_lock:
+            if self.weka_cluster is not failed_cluster:
+                return True, "already reconnected by another thread"
+            start_time, start = time.time(), time.perf_counter()
+            connected, msg = self.connect()
+            api_trace.api_tracer.trace_reconnect(reason, start_time, time.perf_counter() - start, connected, msg)
+            return connected, msg
+
     def call_weka_api(self, method, parms, max_tries=20):
         raise_exc, err_type, errmsg = None, None, None
         sleep_wait = 5
+        reconnects = 0
         for i in range(max_tries):
+            weka_cluster = self.weka_cluster
             try:
                 log.debug(f"calling api {method} with {parms}")
-                result = self.weka_cluster.call_api(method, parms)
+                result = api_trace.call_api(weka_cluster, method, parms, retry=i, reconnects=reconnects)
                 log.debug(f"api call {method} with {parms} returned type: {type(result)}, len: {len(result)}")
                 return result
             except wekalib.exceptions.APIError as exc:
@@ -328,7 +411,8 @@ class ClusterConnection(object):
                     # could re-read config here in case filesystem name or authfile changed
                     # or other config fixed/changed?
                     # but it will get re-read after a change/reload
-                    connected, msg = self.connect()
+                    connected, msg = self.reconnect(weka_cluster, f"retrying {method}")
+                    reconnects += 1
                     log.warning(f"Tried reconnect to cluster before retry.  Result: {connected} {msg}.")
                     sleep_wait = 20
                 i += 1
@@ -345,10 +429,16 @@ class ClusterConnection(object):
         log.debug(f"Cluster connected: {self.weka_cluster} io_status: {result['io_status']}")
         return True
 
-    def create_snapshot(self, fs, name, access_point_name, upload):
+    def create_snapshot(self, fs, name, access_point_name, upload, existing_snaps=None):
+        # existing_snaps is an optional set of (filesystem, snapname) already on the cluster;
+        # if not provided, the cluster is asked about this snapshot before creating it
         try:
-            status = self.call_weka_api(method="snapshots_list", parms={'file_system': fs, 'name': name})
-            if len(status) == 1:
+            if existing_snaps is None:
+                status = self.call_weka_api(method="snapshots_list", parms={'file_system': fs, 'name': name})
+                snap_exists = len(status) == 1
+            else:
+                snap_exists = (fs, name) in existing_snaps
+            if snap_exists:
                 actions_log.info(f"Snapshot exists: {fs} - {name}")
                 return
             created_snap = self.call_weka_api(method="snapshot_create", parms={
@@ -359,41 +449,61 @@ class ClusterConnection(object):
             if created_snap == None:
                 actions_log.info(f"Snapshot exists: {fs} - {name}")
                 log.info(f"   Snap {fs}/{name} already exists")
+                if existing_snaps is not None:
+                    inventory.snapshot_inventory.invalidate(f"{fs}/{name} exists on cluster but not in inventory")
             else:
                 actions_log.info(f"Created snap {fs} - {name}")
                 log.info(f"   Snap {fs}/{name} created")
-            upload_op = False
-            if upload == True or str(upload).upper() == 'LOCAL':
-                upload_op = "upload"
-            elif str(upload).upper() == 'REMOTE':
-                upload_op = "upload-remote"
+                inventory.snapshot_inventory.apply_create(fs, name, access_point_name, created_snap)
+            upload_op = upload_operation(upload)
             if upload_op:
                 background.QueueOperation(self.weka_cluster, fs, name, upload_op)
         except Exception as exc:
             log.error(f"Error creating snapshot {name} on filesystem {fs}: {exc}")
 
-    def get_snapshots(self):
+    def warm_up(self):
+        # checks the connection ahead of a scheduled minute, so any reconnect happens now rather than in the
+        # middle of the creates; returns True if connected
+        weka_cluster = self.weka_cluster
+        try:
+            api_trace.call_api(weka_cluster, 'status', {})
+            return True
+        except Exception as exc:
+            log.warning(f"Cluster status check before snaps failed, reconnecting: {exc}")
+        connected, msg = self.reconnect(weka_cluster, "warm-up status check failed")
+        log.info(f"Reconnect before snaps: {connected} {msg}")
+        return connected
+
+    def list_cluster_snapshots(self):
         snapshot_list = self.call_weka_api("snapshots_list", {})
         if isinstance(snapshot_list, dict):
             snapshot_list = list(snapshot_list.values())
-        log.debug(f"get_snapshots: {[s['name'] for s in snapshot_list]}")
+        log.debug(f"list_cluster_snapshots: {len(snapshot_list)} snapshots")
         return snapshot_list
 
+    def get_snapshots(self):
+        # served from the shared inventory; only reloaded from the cluster when stale
+        return inventory.snapshot_inventory.get_snapshots()
+
+    def get_existing_snap_names(self, wait=False):
+        # one inventory lookup instead of a snapshots_list call per filesystem before each create; unless wait
+        # is True, doesn't wait for a reload of the inventory that another thread (a retention sweep) is doing
+        try:
+            return inventory.snapshot_inventory.name_set(wait=wait)
+        except Exception as exc:
+            log.error(f"Error listing snapshots before create, checking each filesystem instead: {exc}")
+            return None
+
     def delete_old_snapshots(self, parsed_schedules_dict):
         # look at all defined schedule groups, not just last loop snaps
         # in case retentions have changed (for example, to 0)
+        # returns the number of deletes queued
         all_snaps = self.get_snapshots()
-        sg_list = list(parsed_schedules_dict.values())
-        for sg in sg_list:
-            for entry in sg.entries:
-                for fs in sg.filesystems:
-                    snaps = get_fs_snaps(all_snaps, fs, entry.name)
-                    if len(snaps) > entry.retain:
-                        num_to_delete = len(snaps) - entry.retain
-                        snaps_to_delete = snaps[:num_to_delete]
-                        for s in snaps_to_delete:
-                            log.info(f"Queueing fs/snap: {fs}/{s['name']} for delete")
-                            background.QueueOperation(self.weka_cluster, fs, s['name'], "delete")
+        snaps_to_delete = get_snaps_to_delete(parsed_schedules_dict, all_snaps)
+        for fs, s in snaps_to_delete:
+            log.info(f"Queueing fs/snap: {fs}/{s['name']} for delete")
+            background.QueueOperation(self.weka_cluster, fs, s['name'], "delete")
+        return len(snaps_to_delete)
 
 def _exit_with_connection_status(connected):
     if connected:
@@ -427,33 +537,101 @@ class ScheduleGroup(object):
 def _log_snapgrouplist(snapgroup_list):
     [sg.print_readable(log, logging.DEBUG) for sg in snapgroup_list]
 
-def _update_snaptimes_sorted(snapgrouplist, now_dt):
-    unused_list = []
-    log.debug(f"schedule groups before unused check: {len(snapgrouplist)}")
-    for sg in snapgrouplist:
-        if len(sg.filesystems) == 0:
-            unused_list.append(sg)
-    log.warning(f"Unused schedules: {[s.name for s in unused_list]}")
-    for sg in unused_list:
-        snapgrouplist.remove(sg)
-    log.debug(f"schedule groups after unused check:"
-              f" {len(snapgrouplist)} {[(s.name, s.filesystems) for s in snapgrouplist]}")
-    # update snaptimes in entries and in SnapGroups, and sort
-    for sg in snapgrouplist:
-        for entry in sg.entries:
-            entry.calc_next_snaptime(now_dt)
-        sg.entries.sort(key=attrgetter('nextsnap_dt', 'sort_priority', 'no_upload'))
-        log.debug(f"Sorted entries for {sg.name} fs: {sg.filesystems} entries: {[e.sort_priority for e in sg.entries]}")
+def upload_operation(upload):
+    # background operation for a schedule entry's upload: setting, or False
+    if upload == True or str(upload).upper() == 'LOCAL':
+        return "upload"
+    elif str(upload).upper() == 'REMOTE':
+        return "upload-remote"
+    return False
+
+class ScheduleTimeline(object):
+    # Upcoming snaps for the used schedule groups, as a heap with one event per entry:
+    # (nextsnap_dt, sort_priority, no_upload, group index, entry index).   Built when the config is (re)loaded;
+    # after that only the entries that fired, or whose time passed, are recomputed and pushed back.
+    def __init__(self, snapgroups, now_dt):
+        self.groups = []
+        self._entries = []
+        self._heap = []
+        self._build(snapgroups, now_dt, known_entries=set())
+        log.info(f"Schedule timeline built: {len(self._heap)} events for {len(self.groups)} schedule groups")
+
+    def _build(self, snapgroups, now_dt, known_entries):
+        # entries whose id is in known_entries already have a current nextsnap_dt; the rest are calculated
+        snapgroups = list(snapgroups)
+        self.groups = [sg for sg in snapgroups if len(sg.filesystems) > 0]
+        unused = [sg.name for sg in snapgroups if len(sg.filesystems) == 0]
+        if unused:
+            log.warning(f"Unused schedules: {unused}")
+        self._entries = [list(sg.entries) for sg in self.groups]    # sg.entries gets re-sorted for display
+        self._heap = []
+        calculated = 0
+        for gi, entries in enumerate(self._entries):
+            for ei, entry in enumerate(entries):
+                if id(entry) not in known_entries:
+                    entry.calc_next_snaptime(now_dt)
+                    calculated += 1
+                self._push(gi, ei)
+            self._update_group(gi)
+        heapq.heapify(self._heap)
+        return calculated
+
+    def update(self, snapgroups, now_dt):
+        # after a config reload that kept some of the schedule entry objects: only new or changed entries
+        # are calculated, and entries whose time has passed are moved on by the next call, as usual
+        known_entries = {id(entry) for entries in self._entries for entry in entries}
+        calculated = self._build(snapgroups, now_dt, known_entries)
+        log.info(f"Schedule timeline updated: {len(self._heap)} events for {len(self.groups)} schedule groups,"
+                 f" {calculated} entries recalculated")
+
+    def _push(self, gi, ei):
+        entry = self._entries[gi][ei]
+        if entry.nextsnap_dt != datetime.datetime.max:      # retain 0 - never snaps
+            heapq.heappush(self._heap, (entry.nextsnap_dt, entry.sort_priority, entry.no_upload, gi, ei))
+
+    def _update_group(self, gi):
+        sg = self.groups[gi]
+        # a new sorted list rather than sort() in place, which leaves the list looking empty to other threads
+        # (the status UI) until it's done
+        sg.entries = sorted(sg.entries, key=attrgetter('nextsnap_dt', 'sort_priority', 'no_upload'))
         if len(sg.entries) > 0:
             sg.next_snap_time = sg.entries[0].nextsnap_dt
             sg.sort_priority = sg.entries[0].sort_priority
             sg.no_upload = sg.entries[0].no_upload
-    snapgrouplist.sort(key=attrgetter('next_snap_time', 'sort_priority', 'no_upload'))
-    log.info(f"schedule groups after sort:"
-             f" {len(snapgrouplist)} {[(s.name, str(s.next_snap_time), s.filesystems) for s in snapgrouplist]}")
 
-def get_snapgroups_for_snaptime(snapgroup_list, snaptime):
-    return [item for item in snapgroup_list if item.next_snap_time == snaptime]
+    def _recompute_before(self, now_dt):
+        # events before now's minute have fired or were missed; move them to their next time after now
+        now_minute = now_dt.replace(second=0, microsecond=0)
+        changed = set()
+        while self._heap and self._heap[0][0] < now_minute:
+            _, _, _, gi, ei = heapq.heappop(self._heap)
+            self._entries[gi][ei].calc_next_snaptime(now_dt)
+            self._push(gi, ei)
+            changed.add(gi)
+        for gi in changed:
+            self._update_group(gi)
+
+    def advance(self, snap_time):
+        # called after the snaps for snap_time are created
+        self._recompute_before(snap_time + datetime.timedelta(minutes=1))
+
+    def next_snapgroups(self, now_dt):
+        # returns the next snap time, and the groups that snap then, in priority order
+        self._recompute_before(now_dt)
+        if not self._heap:
+            return datetime.datetime.max, []
+        next_snap_time = self._heap[0][0]
+        due = []
+        while self._heap and self._heap[0][0] == next_snap_time:
+            due.append(heapq.heappop(self._heap))
+        for event in due:
+            heapq.heappush(self._heap, event)
+        snapgroups, seen = [], set()
+        for _, _, _, gi, _ in due:      # heap order: a group's first event is its best entry for this time
+            if gi not in seen:
+                seen.add(gi)
+                snapgroups.append(self.groups[gi])
+        return next_snap_time, snapgroups
 
 def get_file_mtime(path):
     mtimeos = os.path.getmtime(path)
@@ -474,8 +652,20 @@ class SnaptoolConfig(object):
         self.resolved_actions_log = None
         self.next_snap_time = datetime.datetime.now()
         self.next_snaps_dict = {}
+        self.timeline = None
         self.background_progress_message = ""
         self.flask_http_port = 8090
+        self.create_workers = 16
+        self.last_create_latencies = {}
+        self.last_lateness = None
+        self.lateness_history = deque(maxlen=LATENESS_HISTORY)   # (scheduled time, seconds late) per tick
+        self.inventory_refresh = inventory.DEFAULT_REFRESH_INTERVAL
+        self.retention_sweep_interval = retention.DEFAULT_MIN_INTERVAL
+        self.warmup_seconds = DEFAULT_WARMUP_SECONDS
+        self.prepared_creates = None    # (snap time, next_snaps_dict, creates, existing snaps) from warm_up()
+        self.warm_up_thread = None
+        self.upload_workers = 2
+        self.delete_workers = 4
         self.obs_list = []
         self.filesystems = []
 
@@ -483,7 +673,7 @@ class SnaptoolConfig(object):
         log.debug(f"Loading config file {self.configfile}")
         try:
             with open(self.configfile, 'r') as f:
-                config = yaml.load(stream=f, Loader=yaml.BaseLoader)
+                config = yaml.load(stream=f, Loader=YAML_LOADER)
             log.debug(config)
             self.config = config
             self.configfile_time = get_file_mtime(self.configfile)
@@ -551,6 +741,28 @@ class SnaptoolConfig(object):
             if 'host' in st:
                 h = st['host']
                 log.info(f"from config file - snaptool.host = {h}")
+            if 'inventory_refresh' in st:
+                self.inventory_refresh = _parse_positive_int(st['inventory_refresh'], 'inventory_refresh',
+                                                             self.inventory_refresh)
+                log.info(f"from config file - snaptool.inventory_refresh = {self.inventory_refresh}")
+            if 'retention_sweep_interval' in st:
+                self.retention_sweep_interval = _parse_positive_int(st['retention_sweep_interval'],
+                                                                    'retention_sweep_interval',
+                                                                    self.retention_sweep_interval)
+                log.info(f"from config file - snaptool.retention_sweep_interval = {self.retention_sweep_interval}")
+            if 'warmup_seconds' in st:
+                self.warmup_seconds = _parse_positive_int(st['warmup_seconds'], 'warmup_seconds',
+                                                          self.warmup_seconds, minimum=0)
+                log.info(f"from config file - snaptool.warmup_seconds = {self.warmup_seconds}")
+            if 'upload_workers' in st:
+                self.upload_workers = _parse_positive_int(st['upload_workers'], 'upload_workers', self.upload_workers)
+                log.info(f"from config file - snaptool.upload_workers = {self.upload_workers}")
+            if 'delete_workers' in st:
+                self.delete_workers = _parse_positive_int(st['delete_workers'], 'delete_workers', self.delete_workers)
+                log.info(f"from config file - snaptool.delete_workers = {self.delete_workers}")
+            if 'create_workers' in st:
+                self.create_workers = _parse_positive_int(st['create_workers'], 'create_workers', self.create_workers)
+                log.info(f"from config file - snaptool.create_workers = {self.create_workers}")
         self.flask_http_port = int(p)
         return p, h
 
@@ -582,7 +794,7 @@ class SnaptoolConfig(object):
             if isinstance(fs_schedulegroups, str):
                 fs_schedulegroups = snapshots.comma_string_to_list(fs_schedulegroups)
                 filesystems[fs_name] = fs_schedulegroups
-            log.info(f"{fs_name}, {fs_schedulegroups}")
+            log.debug(f"{fs_name}, {fs_schedulegroups}")
             for sched_name in fs_schedulegroups:
                 if sched_name not in resultsdict.keys():
                     self.ignored_errors.append(f"Schedule '{sched_name}' is listed for filesystem {fs_name} but not defined")
@@ -594,14 +806,56 @@ class SnaptoolConfig(object):
         self.schedules_dict = {**self.schedules_dict_used, **self.schedules_dict_unused}
         return resultsdict
     
-    def update_schedule_changes(self, new_schedules, new_unused, new_used, new_ignored, new_errors):
-        self.schedules_dict = new_schedules
-        self.schedules_dict_unused = new_unused
-        self.schedules_dict_used = new_used
-        self.ignored_errors = new_ignored
-        self.errors = new_errors
+    def update_schedule_changes(self, new_stc):
+        # take the schedules parsed by new_stc, keeping this config's ScheduleGroup and entry objects (and
+        # their computed snap times) where the schedule spec didn't change, so the timeline only recalculates
+        # what did
+        old_groups = self.schedules_dict or {}
+        merged = {}
+        reused_entries, changed_groups = 0, []
+        for name, new_sg in new_stc.schedules_dict.items():
+            old_sg = old_groups.get(name)
+            if old_sg is None:
+                merged[name] = new_sg
+                changed_groups.append(name)
+                continue
+            old_entries = {entry.name: entry for entry in old_sg.entries}
+            entries = []
+            for entry in new_sg.entries:
+                old_entry = old_entries.get(entry.name)
+                if old_entry is not None and type(old_entry) is type(entry) and old_entry.spec == entry.spec:
+                    entries.append(old_entry)
+                    reused_entries += 1
+                else:
+                    entries.append(entry)
+            if len(entries) != len(old_sg.entries) or any(e not in old_sg.entries for e in entries) \
+                    or bool(old_sg.filesystems) != bool(new_sg.filesystems):
+                changed_groups.append(name)
+            old_sg.entries = entries
+            old_sg.filesystems = new_sg.filesystems
+            merged[name] = old_sg
+        removed_groups = [name for name in old_groups if name not in merged]
+        self.schedules_dict = merged
+        self.schedules_dict_used = {k: v for k, v in merged.items() if v.filesystems}
+        self.schedules_dict_unused = {k: v for k, v in merged.items() if not v.filesystems}
+        self.ignored_errors = new_stc.ignored_errors
+        self.errors = new_stc.errors
+        timeline_order = [sg.name for sg in self.timeline.groups] if self.timeline is not None else []
+        if self.timeline is not None and (changed_groups or removed_groups or
+                                          timeline_order != list(self.schedules_dict_used)):
+            self.timeline.update(merged.values(), now())
+        # otherwise only filesystem assignments changed, which the timeline doesn't depend on
+        log.info(f"Schedules updated: {len(merged)} groups, {reused_entries} entries kept,"
+                 f" changed/added groups: {changed_groups}, removed groups: {removed_groups}")
 
     def reload(self, always_reconnect=False):
+        start = time.perf_counter()
+        result = self._reload(always_reconnect)
+        elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+        log.info(f"Config reload took {elapsed_ms} ms (connected: {bool(result[0])})")
+        return result
+
+    def _reload(self, always_reconnect):
         if not os.path.exists(self.configfile):
             m = f"Config file {self.configfile} missing."
             log.error(m)
@@ -613,6 +867,14 @@ class SnaptoolConfig(object):
             new_stc = SnaptoolConfig(self.configfile, self.args)
             new_stc.load_config()
             new_stc.parse_snaptool_settings()
+            self.create_workers = new_stc.create_workers
+            self.inventory_refresh = new_stc.inventory_refresh
+            inventory.snapshot_inventory.refresh_interval = self.inventory_refresh
+            self.retention_sweep_interval = new_stc.retention_sweep_interval
+            retention.retention_sweeper.min_interval = self.retention_sweep_interval
+            self.warmup_seconds = new_stc.warmup_seconds
+            self.upload_workers, self.delete_workers = new_stc.upload_workers, new_stc.delete_workers
+            background.operation_lanes.set_worker_counts(self.upload_workers, self.delete_workers)
             if new_stc.flask_http_port != self.flask_http_port:
                 if new_stc.flask_http_port != 0:
                     log.info(f"(Re)tarting ui from reload...")
@@ -626,13 +888,14 @@ class SnaptoolConfig(object):
                     stop_ui()
                     self.flask_http_port = new_stc.flask_http_port
             new_stc.parse_fs_schedules()
+            # reloaded on next use, so it's cheap to drop on every reload (buckets may have been attached or
+            # detached, or the cluster may have changed)
+            background.filesystem_buckets.invalidate()
             new_connection = new_stc.create_cluster_connection()
             if not self.config:
                 self.config = new_stc.config
                 self.cluster_connection = new_connection
-                self.update_schedule_changes(new_stc.schedules_dict,
-                        new_stc.schedules_dict_unused, new_stc.schedules_dict_used, 
-                        new_stc.ignored_errors, new_stc.errors)
+                self.update_schedule_changes(new_stc)
             if always_reconnect or not self.cluster_connection or self.cluster_connection.connection_info_different(new_connection):
                 log.info(f"-------------------- (Re)connecting with new cluster configuration...")
                 connected, msg = new_connection.connect()
@@ -640,9 +903,7 @@ class SnaptoolConfig(object):
                 if connected:
                     self.errors = []
                     self.config = new_stc.config
-                    self.update_schedule_changes(new_stc.schedules_dict,
-                        new_stc.schedules_dict_unused, new_stc.schedules_dict_used, 
-                        new_stc.ignored_errors, new_stc.errors)
+                    self.update_schedule_changes(new_stc)
                     self.cluster_connection = new_connection
                     return connected, True
                 else:
@@ -652,9 +913,7 @@ class SnaptoolConfig(object):
                     return connected, True
             else:
                 log.info(f"--------------------   No cluster connection changes to config file since last good connect.")
-                self.update_schedule_changes(new_stc.schedules_dict,
-                    new_stc.schedules_dict_unused, new_stc.schedules_dict_used, 
-                    new_stc.ignored_errors, new_stc.errors)
+                self.update_schedule_changes(new_stc)
                 return True, True
         except Exception as e:
             m = f"Reload error for {self.configfile}; using existing config info. {e}"
@@ -663,28 +922,54 @@ class SnaptoolConfig(object):
             return False, True
 
     def sleep_with_reloads(self, num_seconds, check_interval_seconds):
-        sleep_time_left = num_seconds
-        while sleep_time_left > 0:
-            sleep_time = min(check_interval_seconds, sleep_time_left)
-            sleep_time_left -= sleep_time
-            time.sleep(sleep_time)
+        # sleeps num_seconds, waking early only to reload a changed config file; returns True if a new config
+        # was loaded.   check_interval_seconds is how often the file is checked when inotify isn't available.
+        config_watch.config_watcher.poll_interval = check_interval_seconds
+        config_watch.config_watcher.start(self.configfile)
+        deadline = time.monotonic() + num_seconds
+        while config_watch.config_watcher.wait(deadline - time.monotonic()):
+            config_watch.config_watcher.clear()
             if not os.path.exists(self.configfile):
+                # may be mid-save (removed, then written again); the next change wakes us
                 m = f"Config file {self.configfile} missing."
                 log.error(m)
                 self.errors.append(m)
-                return False
-            elif get_file_mtime(self.configfile) > self.configfile_time:
+            elif get_file_mtime(self.configfile) != self.configfile_time:
                 use_new_config, _ = self.reload()
                 if use_new_config:
                     return True
         return False
 
+    def wait_for_snap_time(self, snap_time, check_interval_seconds):
+        # waits until the wall clock reaches snap_time, reloading the config if it changes meanwhile; returns
+        # True if a new config was loaded (so the next snap time may have changed).   Each wait is timed with
+        # the monotonic clock, and is at most MAX_WAIT_SLICE seconds so a step in the wall clock is noticed.
+        while True:
+            remaining = (snap_time - now()).total_seconds()
+            if remaining <= 0:
+                return False
+            if self.sleep_with_reloads(min(remaining, MAX_WAIT_SLICE), check_interval_seconds):
+                return True
+
+    def record_lateness(self, next_snap_time):
+        # schedule lateness: how long after the scheduled minute the creates for it started
+        lateness = round((now() - next_snap_time).total_seconds(), 3)
+        self.last_lateness = lateness
+        lateness_seconds.observe(lateness)
+        last_lateness_seconds.set(lateness)
+        self.lateness_history.append((next_snap_time, lateness))
+        if lateness > LATENESS_WARNING:
+            log.warning(f"Snaps for {next_snap_time} started {lateness}s late")
+        else:
+            log.info(f"Snaps for {next_snap_time} started {lateness}s after the scheduled time")
+        return lateness
+
     def next_snaps(self):
-        sg_list = list(self.schedules_dict.values())
-        _update_snaptimes_sorted(sg_list, now())
-        _log_snapgrouplist(sg_list)
-        next_snap_time = sg_list[0].entries[0].nextsnap_dt  # because it's sorted this works
-        snapgroups_for_nextsnap = get_snapgroups_for_snaptime(sg_list, next_snap_time)
+        if self.timeline is None:
+            self.timeline = ScheduleTimeline(self.schedules_dict.values(), now())
+        next_snap_time, snapgroups_for_nextsnap = self.timeline.next_snapgroups(now())
+        if log.isEnabledFor(logging.DEBUG):
+            _log_snapgrouplist(self.timeline.groups)
         log.debug(f"next snap time: {next_snap_time}, {len(snapgroups_for_nextsnap)} snaps")
         next_snaps_dict = get_snaps_dict_by_fs(snapgroups_for_nextsnap, next_snap_time)
         sleep_time_left = round((next_snap_time - now()).total_seconds(), 1)
@@ -701,26 +986,110 @@ class SnaptoolConfig(object):
         self.next_snaps_dict = next_snaps_dict
         return next_snap_time, next_snaps_dict, sleep_time_left
 
-    def create_new_snapshots(self, next_snaps_dict, next_snap_time):
+    def snapshot_names(self, fs, snap, next_snap_time):
+        format = self.args.access_point_format
+        access_point_name = next_snap_time.astimezone(timezone.utc).strftime(format)
+        # default is     "@GMT-%Y.%m.%d-%H.%M.%S"  # used to support windows previous versions
+        # don't need century, or date at all really, because snap creation time is used for delete and comparisons
+        # date in the name is really for convenience in displays
+        # allowed substitions
+        # single % from strftime (%y, %m, etc)
+        # %%name - replaced with snapshot definition name (doesn't include the added date)
+        # %%fs - replaced with filesystem name
+        # otherwise this is standard strftime format
+        access_point_name = access_point_name.replace("%name", snap.name)
+        access_point_name = access_point_name.replace("%fs", fs)
+        next_snap_name = snap.name + "." + next_snap_time.strftime("%y%m%d%H%M")
+        return next_snap_name, access_point_name
+
+    def _create_snapshot_timed(self, fs, next_snap_name, access_point_name, upload, existing_snaps):
+        log.info(f"Creating fs/snap {fs}/{next_snap_name} (name len={len(next_snap_name)})")
+        start = time.monotonic()
+        self.cluster_connection.create_snapshot(fs, next_snap_name, access_point_name, upload, existing_snaps)
+        return fs, start, time.monotonic()
+
+    def plan_creates(self, next_snaps_dict, next_snap_time):
+        # returns [(fs, snap name, access point name, upload), ...] for the snaps due at next_snap_time
+        creates = []
         for fs, snap in next_snaps_dict.items():
-            format = self.args.access_point_format
-            access_point_name = next_snap_time.astimezone(timezone.utc).strftime(format)
-            # default is     "@GMT-%Y.%m.%d-%H.%M.%S"  # used to support windows previous versions
-            # don't need century, or date at all really, because snap creation time is used for delete and comparisons
-            # date in the name is really for convenience in displays
-            # allowed substitions
-            # single % from strftime (%y, %m, etc)
-            # %%name - replaced with snapshot definition name (doesn't include the added date)
-            # %%fs - replaced with filesystem name
-            # otherwise this is standard strftime format
-            access_point_name = access_point_name.replace("%name", snap.name)
-            access_point_name = access_point_name.replace("%fs", fs)
-            next_snap_name = snap.name + "." + next_snap_time.strftime("%y%m%d%H%M")
-            log.info(f"Creating fs/snap {fs}/{next_snap_name} (name len={len(next_snap_name)})")
-            self.cluster_connection.create_snapshot(fs, next_snap_name, access_point_name, snap.upload)
-
-    def delete_old_snapshots(self):
-        self.cluster_connection.delete_old_snapshots(self.schedules_dict)
+            next_snap_name, access_point_name = self.snapshot_names(fs, snap, next_snap_time)
+            log.debug(f"Planned fs/snap {fs}/{next_snap_name} for {next_snap_time}")
+            creates.append((fs, next_snap_name, access_point_name, snap.upload))
+        return creates
+
+    def start_warm_up(self, next_snaps_dict, next_snap_time):
+        # warm_up() runs in a thread of its own so that a slow or unreachable cluster (call_weka_api retries
+        # and reconnects for minutes) can't hold up the creates: they go ahead at next_snap_time whatever
+        # state the warm-up is in, and do themselves whatever it didn't get to
+        self.prepared_creates = None
+        if not next_snaps_dict or now() >= next_snap_time:    # too late to be of any use
+            return
+        if self.warm_up_thread is not None and self.warm_up_thread.is_alive():
+            log.warning(f"Skipping warm-up for {next_snap_time}: the previous warm-up is still running")
+            return
+        self.warm_up_thread = threading.Thread(target=self.warm_up, args=(next_snaps_dict, next_snap_time),
+                                               daemon=True, name="warm_up")
+        self.warm_up_thread.start()
+
+    def warm_up(self, next_snaps_dict, next_snap_time):
+        # runs warmup_seconds before next_snap_time so that the scheduled minute only has the snapshot_create
+        # calls left to do: checks the cluster connection, loads the snapshot inventory if it's stale, and
+        # works out the snapshot and access point names
+        start = time.monotonic()
+        self.prepared_creates = None
+        if not next_snaps_dict:
+            return
+        try:
+            connected = self.cluster_connection.warm_up()
+            creates = self.plan_creates(next_snaps_dict, next_snap_time)
+            names = self.cluster_connection.get_existing_snap_names(wait=True)
+            existing_snaps = None if names is None else {(c[0], c[1]) for c in creates if (c[0], c[1]) in names}
+        except Exception as exc:
+            log.error(f"Warm-up for {next_snap_time} failed: {exc}")
+            return
+        self.prepared_creates = (next_snap_time, next_snaps_dict, creates, existing_snaps)
+        log.info(f"Warm-up for {next_snap_time}: {len(creates)} creates prepared, connected: {connected},"
+                 f" took {round(time.monotonic() - start, 3)}s")
+        if now() >= next_snap_time:
+            log.warning(f"Warm-up for {next_snap_time} finished after the snap time; its results weren't used")
+
+    def create_new_snapshots(self, next_snaps_dict, next_snap_time):
+        # creates for all filesystems are issued in parallel so that the snapshots for one scheduled minute
+        # are taken as close to the same point in time as possible
+        lateness = self.record_lateness(next_snap_time)
+        if self.timeline is not None:
+            self.timeline.advance(next_snap_time)
+        prepared, self.prepared_creates = self.prepared_creates, None
+        if prepared is not None and prepared[0] == next_snap_time and prepared[1] is next_snaps_dict:
+            _, _, creates, existing_snaps = prepared
+        else:
+            if self.warmup_seconds > 0:
+                log.info(f"No warm-up results for {next_snap_time}; preparing the creates now")
+            creates = self.plan_creates(next_snaps_dict, next_snap_time)
+            existing_snaps = None
+        if not creates:
+            return
+        if existing_snaps is None:
+            # 'already exists' errors from snapshot_create still cover snaps created after this listing
+            existing_snaps = self.cluster_connection.get_existing_snap_names()
+        num_workers = min(self.create_workers, len(creates))
+        with ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="snap_create") as executor:
+            futures = [executor.submit(self._create_snapshot_timed, *c, existing_snaps) for c in creates]
+            results = [f.result() for f in futures]
+        latencies = {fs: round(end - start, 3) for fs, start, end in results}
+        for fs, latency in latencies.items():
+            log.info(f"   create latency for {fs}: {latency}s")
+        first_done = min(end for _, _, end in results)
+        last_done = max(end for _, _, end in results)
+        spread = round(last_done - first_done, 3)
+        self.last_create_latencies = latencies
+        m = f"Created {len(creates)} snaps for {next_snap_time} with {num_workers} workers:" \
+            f" lateness {lateness}s, max latency {max(latencies.values())}s, first-to-last spread {spread}s"
+        background.background_q.message(m)
+
+    def delete_old_snapshots(self, reason):
+        # asks the retention sweeper thread for a sweep; never waits for it
+        retention.retention_sweeper.request(self.cluster_connection, self.schedules_dict, reason)
 
 def get_snaps_dict_by_fs(snapgroups_for_nextsnap, next_snap_time):
     results = {}
@@ -748,13 +1117,37 @@ def get_fs_snaps(all_snaps, fs, schedname):
     snaps_for_fs.sort(key=itemgetter('creationTime'))
     return snaps_for_fs
 
+def get_snaps_by_fs_schedule(all_snaps):
+    # single pass version of get_fs_snaps for all filesystems and schedules at once:
+    # returns {(fs, schedname): [snaps sorted by creation time]} for snaps named <schedname>.<yymmddhhmm>
+    buckets = {}
+    for s in all_snaps:
+        schedname = inventory.snap_schedule_name(s['name'])
+        if schedname is not None:
+            buckets.setdefault((s['filesystem'], schedname), []).append(s)
+    for snaps in buckets.values():
+        snaps.sort(key=itemgetter('creationTime'))
+    return buckets
+
+def get_snaps_to_delete(parsed_schedules_dict, all_snaps):
+    # returns [(fs, snap), ...] for snaps beyond their schedule's retain count, oldest first
+    buckets = get_snaps_by_fs_schedule(all_snaps)
+    results = []
+    for sg in parsed_schedules_dict.values():
+        for entry in sg.entries:
+            for fs in sg.filesystems:
+                snaps = buckets.get((fs, entry.name), [])
+                if len(snaps) > entry.retain:
+                    num_to_delete = len(snaps) - entry.retain
+                    results.extend((fs, s) for s in snaps[:num_to_delete])
+    return results
+
 def maybe_start_ui(snaptool_config):
     if flask_ui.sconfig == None and snaptool_config.flask_http_port != 0:
         flask_ui.run_ui(snaptool_config)
 
 def stop_ui():
     flask_ui.stop_ui()
-    time.sleep(5)
     flask_ui.sconfig = None
 
 def main():
@@ -772,16 +1165,31 @@ def main():
     # run scheduling computation self tests for snapshots module
     # but don't raise errors for expected failures 
     snapshots.run_schedule_tests(raise_expected_errors=False)    
+    if args.test_schedules:
+        # the full-year differential pass takes tens of seconds, so it's not part of every startup
+        passed = snapshots.run_schedule_differential_tests()
+        print(f"\nSchedule differential tests {'passed' if passed else 'FAILED'}")
+        sys.exit(0 if passed else 1)
 
     snaptool_config = SnaptoolConfig(args.configfile, args)
 
+    if args.forecast is not None:
+        import forecast     # imports this module, so only when needed
+        snaptool_config.load_config()
+        forecast.forecast_config(snaptool_config, args.forecast, output_format=args.forecast_format)
+        sys.exit(0)
+
+    # wakes the main loop as soon as the config file changes
+    config_watch.config_watcher.start(snaptool_config.configfile)
+
     if not args.test_connection_only:
         setup_actions_log()
+        setup_api_trace(args)
         snaptool_config.resolved_actions_log = actions_log_resolved_file
         m = "Initializing background q and replaying operation intent log..."
         log.info(m)
         background.background_q.message(m)
-        background.init_background_q()
+        background.init_background_q(args.intent_log, args.intent_log_sync, args.intent_log_batch_window / 1000)
 
     if args.http_port != 0:
         snaptool_config.flask_http_port = args.http_port
@@ -804,48 +1212,44 @@ def main():
                 cerror = f"Snaptool configuration file {args.configfile} not found"
             background.background_q.message(cerror)
             log.info(cerror)
-            time.sleep(15)
+            config_watch.config_watcher.wait(15)    # try again sooner if the config is fixed
+            config_watch.config_watcher.clear()
         else:
             background.background_q.message("Connected to cluster")
             
     background.intent_log.replay(snaptool_config.cluster_connection.weka_cluster)
 
     try:
-        fs_list = snaptool_config.cluster_connection.call_weka_api("filesystems_list", {})
-        
-        if isinstance(fs_list, list):
-            for fs in fs_list:
-                msg = f"fs {fs['name']}: obs_buckets: {fs['obs_buckets']}"
-                print(msg)
-                log.info(msg)
-        else:
-            for fsid, fsdict in fs_list.items():
-                msg = f"fs {fsdict['name']}: obs_buckets: {fsdict['obs_buckets']}"
-                print(msg)
-                log.info(msg)
+        # also primes the filesystem -> obs_buckets map used by background uploads and deletes
+        fs_buckets = background.filesystem_buckets.load(snaptool_config.cluster_connection.weka_cluster)
+        for fsname, obs_buckets in fs_buckets.items():
+            msg = f"fs {fsname}: obs_buckets: {obs_buckets}"
+            print(msg)
+            log.info(msg)
     except Exception as exc:
         log.error(f"Error getting obs_s3_list or filesystems info: {exc}")
    
     reload_interval = 15
+    sweep_reason = "startup"
 
     while True:
-        # delete is before and after create in the loop to make sure we utilize sleep time for deletes
-        snaptool_config.delete_old_snapshots()
-
-        next_snap_time, next_snaps_dict, sleep_time_left = snaptool_config.next_snaps()
-        new_config_loaded = snaptool_config.sleep_with_reloads(sleep_time_left, reload_interval)
-        if new_config_loaded:
+        # retention sweeps (and the deletes they queue) run in their own thread, after creates and config changes
+        snaptool_config.delete_old_snapshots(sweep_reason)
+
+        # the timeline has moved past the minute just snapped, so the next snap time is always a later minute
+        next_snap_time, next_snaps_dict, _ = snaptool_config.next_snaps()
+        if snaptool_config.warmup_seconds > 0:
+            warmup_time = next_snap_time - datetime.timedelta(seconds=snaptool_config.warmup_seconds)
+            if snaptool_config.wait_for_snap_time(warmup_time, reload_interval):
+                sweep_reason = "config change"
+                continue
+            snaptool_config.start_warm_up(next_snaps_dict, next_snap_time)
+        if snaptool_config.wait_for_snap_time(next_snap_time, reload_interval):
+            sweep_reason = "config change"
             continue
 
         snaptool_config.create_new_snapshots(next_snaps_dict, next_snap_time)
-
-        additional_sleep_time = 60 - round((now() - next_snap_time).total_seconds(), 1)
-        # if it has been less than a minute since the last snaps were created, wait til top of the minute
-        if additional_sleep_time > 0:
-            snaptool_config.delete_old_snapshots()
-            log.info(f"Sleeping for {additional_sleep_time} seconds before next loop")
-            if snaptool_config.sleep_with_reloads(additional_sleep_time, reload_interval):
-                time.sleep(additional_sleep_time - reload_interval)
+        sweep_reason = "creates"
 
 
 if __name__ == '__main__':